@@ -1,12 +1,42 @@
+from __future__ import annotations
+
 import asyncio
+import array
+import functools
+import gzip
+import hashlib
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
+import math
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
 
+import httpx
 from telegram import Update
+from telegram.error import BadRequest, NetworkError, RetryAfter
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
-import httpx
-from playwright.async_api import async_playwright, Browser, Page
+
+# Playwright is imported where first needed - it is only used for token solves,
+# so loading it lazily keeps it off the path to accepting commands
+if TYPE_CHECKING:
+    from playwright.async_api import Browser, BrowserContext, Page, Playwright, Route
+
+try:
+    # Optional: decodes large availability responses several times faster
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure logging
 logging.basicConfig(
@@ -23,6 +53,279 @@ logging.getLogger('urllib3').setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+def loads_json(raw: bytes):
+    """Decode JSON with orjson when it is installed, otherwise the standard library"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from the record's `extra`"""
+    FIELDS = ("target", "window_days", "days", "duration_ms", "token_age_s", "outcome", "suppressed")
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogSampler(logging.Filter):
+    """Let records tagged with `sample_key` through at most once per interval per key.
+    
+    The next emitted record carries the number of lines suppressed in between.
+    """
+    def __init__(self, interval: float = 60.0):
+        super().__init__()
+        self.interval = interval
+        self._last_emit: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample_key", None)
+        if key is None or self.interval <= 0:
+            return True
+        now = time.monotonic()
+        if now - self._last_emit.get(key, float("-inf")) < self.interval:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return False
+        self._last_emit[key] = now
+        suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class PassThroughQueueHandler(QueueHandler):
+    """Enqueue records untouched so formatting happens on the listener thread.
+    
+    The stock prepare() formats the message (and drops exc_info) on the calling
+    thread; that is only needed when the queue crosses a process boundary.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def configure_logging(fmt: str = "text", use_queue: bool = False,
+                      sample_interval: float = 0.0) -> Optional[QueueListener]:
+    """Replace the root handlers according to LOG_* settings.
+    
+    With a queue, the event loop only enqueues records; formatting and I/O
+    happen on the listener thread. Returns the listener so it can be stopped.
+    """
+    root = logging.getLogger()
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    sampler = LogSampler(sample_interval) if sample_interval > 0 else None
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    
+    listener = None
+    if use_queue:
+        front = PassThroughQueueHandler(queue.SimpleQueue())
+        listener = QueueListener(front.queue, handler, respect_handler_level=True)
+        listener.start()
+    else:
+        front = handler
+    if sampler:
+        # Filter before enqueueing so dropped lines cost nothing downstream
+        front.addFilter(sampler)
+    root.addHandler(front)
+    return listener
+
+class Counter:
+    """Monotonic counter with optional labels (Prometheus text format).
+    
+    A callback can supply the unlabelled value at scrape time instead, for
+    values another component already tracks.
+    """
+    kind = "counter"
+    
+    def __init__(self, name: str, help_text: str, callback: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help_text = help_text
+        self._callback = callback
+        self._values: Dict[tuple, float] = {}
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def samples(self):
+        if self._callback is not None:
+            yield self.name, (), self._callback()
+        for key, value in self._values.items():
+            yield self.name, key, value
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = "gauge"
+    
+    def set(self, value: float, **labels):
+        self._values[tuple(sorted(labels.items()))] = value
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels (Prometheus text format)"""
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+    
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+    
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the wrapped block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+    
+    def samples(self):
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", key + (("le", repr(bound)),), cumulative
+            yield f"{self.name}_bucket", key + (("le", "+Inf"),), series[-1]
+            yield f"{self.name}_sum", key, series[-2]
+            yield f"{self.name}_count", key, series[-1]
+
+class RingBuffer:
+    """Fixed-capacity numeric ring buffer backed by array.array.
+    
+    Memory is allocated once up front and stays constant however many values
+    are appended.
+    """
+    def __init__(self, capacity: int, typecode: str = "d"):
+        self.capacity = capacity
+        self._data = array.array(typecode, [0] * capacity)
+        self._next = 0
+        self._size = 0
+    
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+    
+    def values(self) -> list:
+        """Stored values, oldest first"""
+        if self._size < self.capacity:
+            return self._data[:self._size].tolist()
+        return (self._data[self._next:] + self._data[:self._next]).tolist()
+    
+    def __len__(self) -> int:
+        return self._size
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+class CheckHistory:
+    """Recent check outcomes and timings for /stats, in constant memory"""
+    def __init__(self, capacity: int = 500):
+        self.check_durations = RingBuffer(capacity, "d")
+        self.check_outcomes = RingBuffer(capacity, "b")
+        self.refresh_durations = RingBuffer(max(1, capacity // 10), "d")
+        self.last_error: Optional[str] = None
+        self.last_error_at: Optional[datetime] = None
+    
+    def record_check(self, duration: float, success: bool, error: Optional[str] = None):
+        self.check_durations.append(duration)
+        self.check_outcomes.append(1 if success else 0)
+        if error:
+            self.last_error = error
+            self.last_error_at = datetime.now()
+    
+    def record_refresh(self, duration: float):
+        self.refresh_durations.append(duration)
+
+class MetricsRegistry:
+    """Holds the bot's metrics and serves them on a small local HTTP endpoint"""
+    def __init__(self):
+        self._metrics = []
+    
+    def counter(self, name: str, help_text: str, callback: Optional[Callable[[], float]] = None) -> Counter:
+        return self._register(Counter(name, help_text, callback))
+    
+    def gauge(self, name: str, help_text: str, callback: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._register(Gauge(name, help_text, callback))
+    
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+    
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"{name}{{{label_text}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+    
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Serve GET /metrics over plain HTTP/1.0"""
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+                # Drain the request headers
+                while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                    pass
+                parts = request_line.decode(errors="replace").split()
+                if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                    status, body = "200 OK", self.render().encode()
+                else:
+                    status, body = "404 Not Found", b"not found\n"
+                writer.write(
+                    f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+        
+        server = await asyncio.start_server(handle, host, port)
+        logger.info("Metrics available at http://%s:%s/metrics", host, port)
+        return server
+
 class ProxyConfig:
     def __init__(self, proxy_user: str, proxy_password: str, proxy_host: str = "x.botproxy.net", proxy_port: int = 8080):
         self.proxy_user = proxy_user
@@ -41,33 +344,1273 @@ class ProxyConfig:
             "password": self.proxy_password
         }
 
+class HttpClientConfig:
+    """Connection pool and timeout settings for the shared httpx client"""
+    def __init__(self, max_connections: int = 10, max_keepalive_connections: int = 5,
+                 keepalive_expiry: float = 60.0, connect_timeout: float = 10.0,
+                 read_timeout: float = 20.0, pool_timeout: float = 5.0, http2: bool = True):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_timeout = pool_timeout
+        self.http2 = http2
+    
+    @classmethod
+    def from_env(cls) -> "HttpClientConfig":
+        """Build the config from HTTP_* environment variables"""
+        return cls(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "10")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "5")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "20")),
+            pool_timeout=float(os.getenv("HTTP_POOL_TIMEOUT", "5")),
+            http2=os.getenv("HTTP_HTTP2", "true").lower() in ("true", "1", "yes", "on"),
+        )
+    
+    def get_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+    
+    def get_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            self.read_timeout,
+            connect=self.connect_timeout,
+            pool=self.pool_timeout
+        )
+    
+    def http2_available(self) -> bool:
+        """HTTP/2 needs the optional h2 package (httpx[http2])"""
+        if not self.http2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP/2 requested but the h2 package is missing, falling back to HTTP/1.1")
+            return False
+        return True
+
+class WatchKey(NamedTuple):
+    """Identifies one upstream poll target: an office and a service"""
+    office_id: str
+    service_id: str
+    
+    @classmethod
+    def parse_list(cls, value: str) -> List["WatchKey"]:
+        """Parse 'office:service,office:service' (e.g. from WATCH_TARGETS)"""
+        keys = []
+        for item in value.split(","):
+            if not item.strip():
+                continue
+            office_id, _, service_id = item.strip().partition(":")
+            if not office_id or not service_id:
+                raise ValueError(f"Invalid watch target '{item}', expected office_id:service_id")
+            keys.append(cls(office_id, service_id))
+        return keys
+    
+    def __str__(self):
+        return f"{self.office_id}/{self.service_id}"
+
+class Subscription:
+    def __init__(self, chat_id: int, key: WatchKey, interval_minutes: int, window_days: int = 180):
+        self.chat_id = chat_id
+        self.key = key
+        self.interval_minutes = interval_minutes
+        self.window_days = window_days
+        self.created_at = datetime.now()
+    
+    def last_day(self) -> date:
+        """Last date inside this subscriber's window"""
+        return date.today() + timedelta(days=self.window_days)
+
+class SubscriptionRegistry:
+    """Maps watch keys to the chats subscribed to them.
+    
+    All chats watching the same key share a single upstream poll, which runs
+    at the shortest interval and over the widest date window any of them asked
+    for; each chat is then told only about dates inside its own window.
+    """
+    def __init__(self):
+        self._by_key: Dict[WatchKey, Dict[int, Subscription]] = {}
+    
+    def subscribe(self, chat_id: int, key: WatchKey, interval_minutes: int, window_days: int = 180) -> Subscription:
+        """Add or update a chat's subscription to a key"""
+        subscription = Subscription(chat_id, key, interval_minutes, window_days)
+        self._by_key.setdefault(key, {})[chat_id] = subscription
+        return subscription
+    
+    def unsubscribe(self, chat_id: int) -> List[WatchKey]:
+        """Remove a chat from every key; return keys left without subscribers"""
+        emptied = []
+        for key in list(self._by_key):
+            subscribers = self._by_key[key]
+            if subscribers.pop(chat_id, None) is not None and not subscribers:
+                del self._by_key[key]
+                emptied.append(key)
+        return emptied
+    
+    def remove_key(self, key: WatchKey) -> List[int]:
+        """Drop a key and return the chats that were subscribed to it"""
+        return list(self._by_key.pop(key, {}))
+    
+    def subscribers(self, key: WatchKey) -> List[int]:
+        return list(self._by_key.get(key, {}))
+    
+    def subscriptions(self, key: WatchKey) -> List[Subscription]:
+        return list(self._by_key.get(key, {}).values())
+    
+    def has_subscribers(self, key: WatchKey) -> bool:
+        return bool(self._by_key.get(key))
+    
+    def interval_for(self, key: WatchKey) -> Optional[int]:
+        """Shortest interval (minutes) requested for a key"""
+        subscribers = self._by_key.get(key)
+        if not subscribers:
+            return None
+        return min(sub.interval_minutes for sub in subscribers.values())
+    
+    def window_for(self, key: WatchKey) -> Optional[int]:
+        """Merged date window (days) for a key - every window starts today, so the widest covers all"""
+        subscribers = self._by_key.get(key)
+        if not subscribers:
+            return None
+        return max(sub.window_days for sub in subscribers.values())
+    
+    def subscriptions_for_chat(self, chat_id: int) -> List[Subscription]:
+        return [subs[chat_id] for subs in self._by_key.values() if chat_id in subs]
+    
+    def longest_interval(self) -> Optional[int]:
+        """Longest polling interval (minutes) across all keys, None without subscriptions"""
+        intervals = [self.interval_for(key) for key in self._by_key]
+        return max(intervals) if intervals else None
+    
+    def keys(self) -> List[WatchKey]:
+        return list(self._by_key)
+    
+    def __len__(self) -> int:
+        return sum(len(subs) for subs in self._by_key.values())
+
+class UpstreamHTTPError(Exception):
+    """The appointment API answered with a rate limit (429) or server error (5xx)"""
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"Upstream HTTP {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+    
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Parse a Retry-After header given either in seconds or as an HTTP date"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+class PollScheduler:
+    """Decides when each watch key polls next and enforces a global request budget.
+    
+    Ticks are spread with random jitter, failures back off exponentially per key,
+    Retry-After pauses all upstream requests, and an optional requests-per-minute
+    budget spaces requests evenly across every watch.
+    """
+    def __init__(self, jitter: float = 0.1, max_backoff: float = 1800.0,
+                 requests_per_minute: Optional[float] = None, startup_spread: float = 30.0):
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.requests_per_minute = requests_per_minute
+        self.startup_spread = startup_spread
+        self._failures: Dict[WatchKey, int] = {}
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._budget_lock = asyncio.Lock()
+    
+    @classmethod
+    def from_env(cls) -> "PollScheduler":
+        """Build the scheduler from POLL_* environment variables"""
+        rpm = float(os.getenv("POLL_RPM_BUDGET", "0"))
+        return cls(
+            jitter=float(os.getenv("POLL_JITTER", "0.1")),
+            max_backoff=float(os.getenv("POLL_MAX_BACKOFF", "1800")),
+            requests_per_minute=rpm if rpm > 0 else None,
+        )
+    
+    def _jittered(self, delay: float) -> float:
+        return max(0.0, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+    
+    def initial_delay(self) -> float:
+        """Random offset so watches resumed together don't fire in the same instant"""
+        return random.uniform(0, self.startup_spread)
+    
+    def record_success(self, key: WatchKey, interval: float) -> float:
+        """Reset backoff for a key and return the delay until its next tick"""
+        self._failures.pop(key, None)
+        return self._jittered(interval)
+    
+    def record_failure(self, key: WatchKey, base_delay: float, retry_after: Optional[float] = None) -> float:
+        """Register a failed tick and return the backoff delay before retrying"""
+        failures = self._failures.get(key, 0) + 1
+        self._failures[key] = failures
+        delay = min(base_delay * 2 ** (failures - 1), self.max_backoff)
+        if retry_after is not None:
+            # The global pause was set by pause() when the response came in
+            delay = max(delay, retry_after)
+        return self._jittered(delay)
+    
+    def pause(self, seconds: float):
+        """Hold every upstream request for this long (the server sent Retry-After)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def failure_count(self, key: WatchKey) -> int:
+        return self._failures.get(key, 0)
+    
+    def forget(self, key: WatchKey):
+        self._failures.pop(key, None)
+    
+    async def acquire(self):
+        """Wait for a Retry-After pause to end and for a free slot in the request budget"""
+        async with self._budget_lock:
+            now = time.monotonic()
+            start = max(now, self._paused_until)
+            if self.requests_per_minute:
+                start = max(start, self._next_slot)
+                self._next_slot = start + 60.0 / self.requests_per_minute
+            if start > now:
+                await asyncio.sleep(start - now)
+
+class PageLoadStats:
+    """What the request filter saved during one token page load"""
+    def __init__(self):
+        self.blocked_requests = 0
+        self.cache_hits = 0
+        self.bytes_saved = 0
+    
+    def __str__(self):
+        return (f"blocked {self.blocked_requests} requests, "
+                f"{self.cache_hits} scripts ({self.bytes_saved / 1024:.0f} KB) served from disk cache")
+
+class RequestFilter:
+    """Playwright route handler that trims the token page load.
+    
+    Aborts resource types the captcha doesn't need (images, media, fonts by
+    default) and requests to known trackers, and can serve static JS bundles
+    from a local disk cache between refreshes.
+    """
+    DEFAULT_BLOCKED_TYPES = ("image", "media", "font")
+    TRACKER_HOSTS = (
+        "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+        "facebook.net", "hotjar.com", "etracker.com", "etracker.de",
+        "siteimproveanalytics.com", "siteimprove.com", "matomo.cloud",
+    )
+    
+    def __init__(self, blocked_types=DEFAULT_BLOCKED_TYPES, block_trackers: bool = True,
+                 js_cache_dir: Optional[str] = None, js_cache_max_age: float = 24 * 3600):
+        self.blocked_types = frozenset(blocked_types)
+        self.block_trackers = block_trackers
+        self.js_cache_dir = js_cache_dir
+        self.js_cache_max_age = js_cache_max_age
+        if js_cache_dir:
+            os.makedirs(js_cache_dir, exist_ok=True)
+    
+    @classmethod
+    def from_env(cls) -> "RequestFilter":
+        """Build the filter from BROWSER_* environment variables"""
+        blocked = os.getenv("BROWSER_BLOCK_RESOURCES", ",".join(cls.DEFAULT_BLOCKED_TYPES))
+        return cls(
+            blocked_types=[t.strip() for t in blocked.split(",") if t.strip()],
+            block_trackers=os.getenv("BROWSER_BLOCK_TRACKERS", "true").lower() in ("true", "1", "yes", "on"),
+            js_cache_dir=os.getenv("BROWSER_JS_CACHE_DIR") or None,
+        )
+    
+    def _is_tracker(self, host: str) -> bool:
+        return any(host == t or host.endswith("." + t) for t in self.TRACKER_HOSTS)
+    
+    def _cache_path(self, url: str) -> str:
+        return os.path.join(self.js_cache_dir, hashlib.sha1(url.encode()).hexdigest() + ".js")
+    
+    def _read_cached(self, path: str) -> Optional[bytes]:
+        try:
+            if time.time() - os.path.getmtime(path) > self.js_cache_max_age:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    @staticmethod
+    def _write_cached(path: str, body: bytes):
+        # Write to a temp file first so a concurrent reader never sees a partial bundle
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+    
+    async def handle(self, route: Route, stats: PageLoadStats):
+        request = route.request
+        parts = urlsplit(request.url)
+        
+        if request.resource_type in self.blocked_types or (
+                self.block_trackers and self._is_tracker(parts.hostname or "")):
+            stats.blocked_requests += 1
+            await route.abort()
+            return
+        
+        if (self.js_cache_dir and request.method == "GET" and request.resource_type == "script"
+                and parts.path.endswith(".js")):
+            path = self._cache_path(request.url)
+            body = await asyncio.to_thread(self._read_cached, path)
+            if body is not None:
+                stats.cache_hits += 1
+                stats.bytes_saved += len(body)
+                await route.fulfill(status=200, body=body, content_type="application/javascript")
+                return
+            try:
+                response = await route.fetch()
+            except Exception as e:
+                logger.debug("Could not fetch %s for caching: %s", request.url, e)
+                await route.continue_()
+                return
+            if response.ok:
+                body = await response.body()
+                try:
+                    await asyncio.to_thread(self._write_cached, path, body)
+                except OSError as e:
+                    logger.debug("Could not cache %s: %s", request.url, e)
+                await route.fulfill(response=response, body=body)
+            else:
+                await route.fulfill(response=response)
+            return
+        
+        await route.continue_()
+
+class BrowserManager:
+    """Owns the Playwright driver, one long-lived Chromium and a recyclable context.
+    
+    Chromium is launched once and only relaunched if it has crashed or
+    disconnected. Token pages share one context, which is thrown away after a
+    number of uses or after a failed solve.
+    """
+    def __init__(self, proxy_config: Optional[ProxyConfig] = None, headless: bool = True,
+                 max_context_uses: int = 20):
+        self.proxy_config = proxy_config
+        self.headless = headless
+        self.max_context_uses = max_context_uses
+        self.playwright: Optional[Playwright] = None
+        self.browser: Optional[Browser] = None
+        self.context: Optional[BrowserContext] = None
+        self.context_uses = 0
+        self.launches = 0
+        self.restarts = 0
+        self.last_launch_duration: Optional[float] = None
+        self._lock = asyncio.Lock()
+    
+    @property
+    def is_running(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+    
+    async def _ensure_browser(self):
+        """Start Playwright and Chromium if needed; relaunch only after a crash"""
+        if self.playwright is None:
+            from playwright.async_api import async_playwright
+            self.playwright = await async_playwright().start()
+        if self.is_running:
+            return
+        if self.browser is not None:
+            logger.warning("Chromium is no longer connected, relaunching")
+            self.restarts += 1
+            self.browser = None
+            self.context = None
+        
+        # Configure browser launch options with proxy if available
+        # Use headless=False when using proxy to avoid bot detection
+        launch_options = {"headless": self.headless}
+        if self.proxy_config:
+            launch_options["proxy"] = self.proxy_config.get_playwright_proxy()
+        
+        started = time.perf_counter()
+        self.browser = await self.playwright.chromium.launch(**launch_options)
+        self.last_launch_duration = time.perf_counter() - started
+        self.launches += 1
+        logger.info("Chromium launched")
+    
+    async def start(self):
+        """Launch Chromium ahead of the first token solve"""
+        async with self._lock:
+            await self._ensure_browser()
+    
+    async def new_page(self) -> Page:
+        """Open a page in the shared context, recycling the context when it is worn out"""
+        async with self._lock:
+            await self._ensure_browser()
+            if self.context is not None and self.context_uses >= self.max_context_uses:
+                await self._close_context()
+            if self.context is None:
+                self.context = await self.browser.new_context()
+                self.context_uses = 0
+            self.context_uses += 1
+            return await self.context.new_page()
+    
+    async def recycle_context(self):
+        """Discard the shared context, e.g. after a failed captcha solve"""
+        async with self._lock:
+            await self._close_context()
+    
+    async def _close_context(self):
+        if self.context is not None:
+            try:
+                await self.context.close()
+            except Exception as e:
+                logger.debug("Error closing browser context: %s", e)
+            self.context = None
+    
+    async def health_check(self) -> bool:
+        """Relaunch Chromium if it was started before and has crashed since"""
+        if self.browser is None or self.is_running:
+            return self.is_running
+        async with self._lock:
+            await self._ensure_browser()
+        return self.is_running
+    
+    async def close(self):
+        """Close the context and browser and stop the Playwright driver"""
+        async with self._lock:
+            await self._close_context()
+            if self.browser is not None:
+                try:
+                    await self.browser.close()
+                except Exception as e:
+                    logger.debug("Error closing browser: %s", e)
+                self.browser = None
+            if self.playwright is not None:
+                await self.playwright.stop()
+                self.playwright = None
+
+class TokenManager:
+    """Keeps the captcha token fresh in the background and hands it out to callers.
+    
+    The token is re-solved shortly before it expires for as long as it has been
+    used recently, i.e. within idle_timeout plus the longest expected gap between
+    uses reported by poll_gap. Concurrent refreshes share a single in-flight future, so the
+    browser flow never runs twice at once.
+    """
+    def __init__(self, solver: Callable[[], Awaitable[str]], lifetime: timedelta = timedelta(minutes=5),
+                 refresh_margin: float = 60.0, idle_timeout: float = 600.0, retry_delay: float = 30.0,
+                 on_token: Optional[Callable[[str, datetime], None]] = None,
+                 poll_gap: Optional[Callable[[], float]] = None,
+                 spawn: Callable[..., asyncio.Future] = asyncio.create_task):
+        self._solver = solver
+        self._spawn = spawn
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.idle_timeout = idle_timeout
+        self.retry_delay = retry_delay
+        self._on_token = on_token
+        self._poll_gap = poll_gap
+        self.token: Optional[str] = None
+        self.expires_at: Optional[datetime] = None
+        self.last_refresh_at: Optional[datetime] = None
+        self.last_refresh_duration: Optional[float] = None
+        self._last_used: Optional[float] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._changed = asyncio.Event()
+    
+    def is_valid(self) -> bool:
+        return bool(self.token and self.expires_at and datetime.now() < self.expires_at)
+    
+    def set(self, token: str, expires_at: datetime):
+        self.token = token
+        self.expires_at = expires_at
+        self._changed.set()
+    
+    def touch(self):
+        """Mark the token as in demand, e.g. when polling resumes after a restart"""
+        self._last_used = time.monotonic()
+        self._changed.set()
+    
+    def idle_window(self) -> float:
+        """Seconds without a request after which the token is no longer kept fresh"""
+        return self.idle_timeout + (self._poll_gap() if self._poll_gap else 0.0)
+    
+    def age(self) -> Optional[float]:
+        """Seconds since the current token was solved"""
+        if not self.token or self.last_refresh_at is None:
+            return None
+        return (datetime.now() - self.last_refresh_at).total_seconds()
+    
+    def invalidate(self):
+        """Drop the current token; the background task re-solves it if still in demand"""
+        self.token = None
+        self.expires_at = None
+        self._changed.set()
+    
+    async def get_token(self) -> str:
+        """Return a valid token, waiting for a refresh only if none is available"""
+        self._last_used = time.monotonic()
+        if self.is_valid():
+            return self.token
+        logger.info("Token expired or invalid, refreshing...")
+        return await self.refresh()
+    
+    async def refresh(self) -> str:
+        """Solve a new token, joining the in-flight refresh if there is one"""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = self._spawn(self._refresh(), name="token-refresh")
+        return await asyncio.shield(self._inflight)
+    
+    async def _refresh(self) -> str:
+        started = time.perf_counter()
+        token = await self._solver()
+        self.last_refresh_duration = time.perf_counter() - started
+        self.last_refresh_at = datetime.now()
+        self.set(token, self.last_refresh_at + self.lifetime)
+        logger.info("Captcha token refreshed in %.1fs", self.last_refresh_duration,
+                    extra={"duration_ms": round(self.last_refresh_duration * 1000, 1)})
+        if self._on_token:
+            self._on_token(token, self.expires_at)
+        return token
+    
+    def _seconds_until_refresh(self) -> Optional[float]:
+        """None while idle, otherwise seconds until the next proactive refresh"""
+        if self._last_used is None or time.monotonic() - self._last_used > self.idle_window():
+            return None
+        if self.expires_at is None:
+            return 0.0
+        return max(0.0, (self.expires_at - datetime.now()).total_seconds() - self.refresh_margin)
+    
+    async def run(self):
+        """Background task: refresh the token ahead of expiry while it is in use"""
+        while True:
+            self._changed.clear()
+            wait = self._seconds_until_refresh()
+            if wait is None or wait > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("Background token refresh failed: %s", e)
+                await asyncio.sleep(self.retry_delay)
+
+class NotificationQueue:
+    """Outbound Telegram queue that decouples delivery from polling.
+    
+    Messages waiting for the same chat are coalesced into one, long messages
+    are split at line boundaries, sends are paced per chat and globally,
+    RetryAfter is honored and transient network errors are retried with backoff.
+    """
+    MAX_MESSAGE_LENGTH = 4096
+    
+    def __init__(self, send: Callable[[int, str], Awaitable], global_rate: float = 25.0,
+                 per_chat_interval: float = 1.0, max_retries: int = 5, linger: float = 0.2,
+                 max_size: int = 10000):
+        self._send = send
+        self.global_interval = 1.0 / global_rate
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.linger = linger
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._next_global = 0.0
+        self._last_sent: Dict[int, float] = {}
+        self._in_flight = 0
+        self.dropped = 0
+    
+    def enqueue(self, chat_id: int, text: str):
+        """Queue a message without waiting for delivery"""
+        try:
+            self._queue.put_nowait((chat_id, text))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Notification queue full, dropping message for chat %s", chat_id)
+    
+    def pending(self) -> int:
+        """Messages not delivered yet, including the batch the worker is sending"""
+        return self._queue.qsize() + self._in_flight
+    
+    async def join(self):
+        await self._queue.join()
+    
+    async def run(self):
+        """Worker: drain the queue, coalescing per chat, and deliver"""
+        while True:
+            chat_id, text = await self._queue.get()
+            self._in_flight = 1
+            # Give closely following updates (e.g. opened + vanished) a moment to arrive
+            await asyncio.sleep(self.linger)
+            batch: Dict[int, List[str]] = {chat_id: [text]}
+            taken = 1
+            while not self._queue.empty():
+                chat_id, text = self._queue.get_nowait()
+                batch.setdefault(chat_id, []).append(text)
+                taken += 1
+                self._in_flight += 1
+            try:
+                for chat_id, texts in batch.items():
+                    for chunk in self.split("\n\n".join(texts)):
+                        await self._pace(chat_id)
+                        try:
+                            await self.deliver(chat_id, chunk)
+                        except Exception as e:
+                            logger.error("Failed to notify chat %s: %s", chat_id, e)
+                    self._in_flight -= len(texts)
+            finally:
+                self._in_flight = 0
+                for _ in range(taken):
+                    self._queue.task_done()
+    
+    async def deliver(self, chat_id: int, text: str):
+        """Send one message, honoring RetryAfter and retrying network errors"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._send(chat_id, text)
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                delay = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+                logger.warning("Telegram rate limit hit, retrying in %.0fs", delay)
+                if attempt == self.max_retries:
+                    raise
+                # Flood limits apply to the whole bot, so hold every send
+                self._next_global = max(self._next_global, time.monotonic() + delay)
+                await asyncio.sleep(delay)
+            except BadRequest:
+                # Subclass of NetworkError, but retrying will not help
+                raise
+            except NetworkError as e:
+                # PTB wraps local failures (e.g. a bot already shut down) in NetworkError too
+                if attempt == self.max_retries or isinstance(e.__cause__, RuntimeError):
+                    raise
+                delay = min(2 ** attempt, 30)
+                logger.warning("Telegram send failed (%s), retrying in %ss", e, delay)
+                await asyncio.sleep(delay)
+    
+    async def _pace(self, chat_id: int):
+        now = time.monotonic()
+        start = max(now, self._next_global, self._last_sent.get(chat_id, 0.0) + self.per_chat_interval)
+        self._next_global = start + self.global_interval
+        self._last_sent[chat_id] = start
+        if start > now:
+            await asyncio.sleep(start - now)
+    
+    @classmethod
+    def split(cls, text: str) -> List[str]:
+        """Split text into Telegram-sized chunks, preferring line boundaries"""
+        if len(text) <= cls.MAX_MESSAGE_LENGTH:
+            return [text]
+        chunks, current = [], ""
+        for line in text.split("\n"):
+            while len(line) > cls.MAX_MESSAGE_LENGTH:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(line[:cls.MAX_MESSAGE_LENGTH])
+                line = line[cls.MAX_MESSAGE_LENGTH:]
+            candidate = f"{current}\n{line}" if current else line
+            if len(candidate) > cls.MAX_MESSAGE_LENGTH:
+                chunks.append(current)
+                current = line
+            else:
+                current = candidate
+        if current:
+            chunks.append(current)
+        return chunks
+
+class TaskSupervisor:
+    """Owns every background task of the bot so none can leak or run twice.
+    
+    Keyed tasks (one monitor per watch target) are deduplicated by key; crashed
+    tasks are logged instead of being lost with their exception. shutdown()
+    cancels everything and waits for it on the running loop.
+    """
+    def __init__(self):
+        self._tasks: set = set()
+        self.keyed: Dict[object, asyncio.Task] = {}
+    
+    def spawn(self, coro: Awaitable, name: Optional[str] = None, report_errors: bool = True) -> asyncio.Task:
+        """Start a tracked task; report_errors=False when its awaiters handle failures"""
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done if report_errors else self._forget)
+        return task
+    
+    def ensure(self, key, factory: Callable[[], Awaitable], name: Optional[str] = None) -> asyncio.Task:
+        """Return the live task for key, starting one from factory() only if there is none"""
+        task = self.keyed.get(key)
+        if task is None or task.done():
+            task = self.spawn(factory(), name=name)
+            self.keyed[key] = task
+        return task
+    
+    async def cancel(self, key) -> bool:
+        """Cancel the task for key and wait until it has finished"""
+        task = self.keyed.pop(key, None)
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+    
+    async def cancel_named(self, *prefixes: str, timeout: float = 10.0):
+        """Cancel the tasks whose name starts with one of prefixes and wait for them"""
+        await self._cancel_and_wait(
+            [task for task in self._tasks if task.get_name().startswith(prefixes)], timeout)
+    
+    async def shutdown(self, timeout: float = 10.0):
+        """Cancel all tasks and wait for their cleanup to run"""
+        await self._cancel_and_wait(list(self._tasks), timeout)
+        self.keyed.clear()
+    
+    async def _cancel_and_wait(self, tasks: List[asyncio.Task], timeout: float):
+        tasks = [task for task in tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                logger.warning("Task %s did not stop within %.0fs", task.get_name(), timeout)
+    
+    def _forget(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        for key, keyed_task in list(self.keyed.items()):
+            if keyed_task is task:
+                del self.keyed[key]
+    
+    def _on_done(self, task: asyncio.Task):
+        self._forget(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background task %s crashed", task.get_name(), exc_info=task.exception())
+    
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+class StartupTimer:
+    """Wall-clock breakdown of a cold start, logged once the bot is warm"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._last = self.started
+    
+    def mark(self, phase: str):
+        """Record the time since the previous mark under phase"""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+    
+    def record(self, phase: str, duration: float):
+        """Record a phase that ran concurrently with others"""
+        self.phases[phase] = duration
+    
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+    
+    def __str__(self) -> str:
+        return ", ".join(f"{phase} {duration:.2f}s" for phase, duration in self.phases.items())
+
+class AvailableDays:
+    """Sorted set of available dates, stored as date ordinals in a compact array.
+    
+    Range queries ("anything before X", "everything up to X") are binary
+    searches and return slices without converting back to dates.
+    """
+    __slots__ = ("_ordinals",)
+    
+    def __init__(self, ordinals: Iterable[int] = ()):
+        self._ordinals = array.array("i", sorted(set(ordinals)))
+    
+    @classmethod
+    def _from_sorted(cls, ordinals: array.array) -> AvailableDays:
+        days = cls.__new__(cls)
+        days._ordinals = ordinals
+        return days
+    
+    @classmethod
+    def from_iso(cls, values: Iterable[str]) -> AvailableDays:
+        """Build from ISO strings; anything after the date part (e.g. a time) is ignored"""
+        return cls(date.fromisoformat(value[:10]).toordinal() for value in values)
+    
+    def iso(self) -> List[str]:
+        return [date.fromordinal(ordinal).isoformat() for ordinal in self._ordinals]
+    
+    def first(self) -> Optional[date]:
+        return date.fromordinal(self._ordinals[0]) if self._ordinals else None
+    
+    def before(self, day: date) -> AvailableDays:
+        """Dates strictly before day"""
+        return self._from_sorted(self._ordinals[:bisect_left(self._ordinals, day.toordinal())])
+    
+    def since(self, day: date) -> AvailableDays:
+        """Dates on or after day"""
+        return self._from_sorted(self._ordinals[bisect_left(self._ordinals, day.toordinal()):])
+    
+    def until(self, day: date) -> AvailableDays:
+        """Dates up to and including day"""
+        return self._from_sorted(self._ordinals[:bisect_right(self._ordinals, day.toordinal())])
+    
+    def any_before(self, day: date) -> bool:
+        return bool(self._ordinals) and self._ordinals[0] < day.toordinal()
+    
+    def difference(self, other: AvailableDays) -> AvailableDays:
+        """Dates in this set but not in other"""
+        if not other._ordinals:
+            return self
+        excluded = set(other._ordinals)
+        return self._from_sorted(array.array("i", (o for o in self._ordinals if o not in excluded)))
+    
+    def format(self) -> str:
+        """One line per month, e.g. 'March 2025: Mon 3, Tue 4, Fri 7'"""
+        lines = []
+        month = None
+        for day in self:
+            if (day.year, day.month) != month:
+                month = (day.year, day.month)
+                lines.append(f"{day:%B %Y}: ")
+            else:
+                lines[-1] += ", "
+            lines[-1] += f"{day:%a} {day.day}"
+        return "\n".join(lines)
+    
+    def __iter__(self) -> Iterator[date]:
+        return (date.fromordinal(ordinal) for ordinal in self._ordinals)
+    
+    def __contains__(self, day: date) -> bool:
+        index = bisect_left(self._ordinals, day.toordinal())
+        return index < len(self._ordinals) and self._ordinals[index] == day.toordinal()
+    
+    def __len__(self) -> int:
+        return len(self._ordinals)
+    
+    def __eq__(self, other) -> bool:
+        return isinstance(other, AvailableDays) and self._ordinals == other._ordinals
+    
+    def __repr__(self) -> str:
+        return f"AvailableDays({self.iso()})"
+
+class AvailabilityChange:
+    """Result of comparing a fresh availability response with the last one seen"""
+    def __init__(self, days: AvailableDays, opened: AvailableDays, vanished: AvailableDays,
+                 content_hash: bytes, changed: bool):
+        self.days = days
+        self.opened = opened
+        self.vanished = vanished
+        self.content_hash = content_hash
+        self.changed = changed
+    
+    @property
+    def has_delta(self) -> bool:
+        return bool(self.opened or self.vanished)
+
+class AvailabilityTracker:
+    """Keeps the last seen available days per watch key.
+    
+    Identical raw responses are detected by hash and skip parsing entirely.
+    """
+    def __init__(self):
+        self._states: Dict[WatchKey, Tuple[bytes, AvailableDays]] = {}
+    
+    def diff(self, key: WatchKey, raw: bytes, parse: Callable[[bytes], AvailableDays]) -> AvailabilityChange:
+        """Compare a raw response with the stored state without committing it"""
+        content_hash = hashlib.blake2b(raw, digest_size=16).digest()
+        previous = self._states.get(key)
+        if previous and previous[0] == content_hash:
+            return AvailabilityChange(previous[1], AvailableDays(), AvailableDays(), content_hash, changed=False)
+        
+        days = parse(raw)
+        old_days = previous[1] if previous else AvailableDays()
+        return AvailabilityChange(
+            days,
+            days.difference(old_days),
+            old_days.difference(days),
+            content_hash,
+            changed=True
+        )
+    
+    def commit(self, key: WatchKey, change: AvailabilityChange):
+        self._states[key] = (change.content_hash, change.days)
+    
+    def restore(self, key: WatchKey, content_hash: bytes, days: AvailableDays):
+        self._states[key] = (content_hash, days)
+    
+    def days(self, key: WatchKey) -> Optional[AvailableDays]:
+        state = self._states.get(key)
+        return state[1] if state else None
+    
+    def forget(self, key: WatchKey):
+        self._states.pop(key, None)
+
+class StateStore:
+    """SQLite-backed persistence for subscriptions, token metadata and availability history.
+    
+    The database runs in WAL mode. Writes are queued in memory and flushed in a
+    single transaction by a background task, so the event loop never waits on disk.
+    """
+    SCHEMA_VERSION = 1
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER NOT NULL,
+            office_id TEXT NOT NULL,
+            service_id TEXT NOT NULL,
+            window_days INTEGER NOT NULL,
+            interval_minutes INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (chat_id, office_id, service_id)
+        );
+        CREATE TABLE IF NOT EXISTS availability_snapshots (
+            office_id TEXT NOT NULL,
+            service_id TEXT NOT NULL,
+            content_hash BLOB NOT NULL,
+            days TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (office_id, service_id)
+        );
+        CREATE TABLE IF NOT EXISTS check_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            checked_at TEXT NOT NULL,
+            office_id TEXT NOT NULL,
+            service_id TEXT NOT NULL,
+            window_days INTEGER NOT NULL,
+            success INTEGER NOT NULL,
+            days_count INTEGER,
+            duration_ms REAL NOT NULL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_check_results_checked_at ON check_results (checked_at);
+        CREATE TABLE IF NOT EXISTS token_metadata (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            token TEXT,
+            expires_at TEXT,
+            refreshed_at TEXT NOT NULL
+        );
+    """
+    
+    def __init__(self, path: str, flush_interval: float = 5.0, batch_size: int = 200,
+                 history_days: int = 30, prune_interval: float = 3600.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.history_days = history_days
+        self.prune_interval = prune_interval
+        self._last_prune: Optional[float] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+        self._pending: List[Tuple[str, tuple]] = []
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+    
+    def open(self):
+        """Open the database, enable WAL and create the schema"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        logger.info("State store opened at %s", self.path)
+    
+    def _has_table(self, name: str) -> bool:
+        return self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone() is not None
+    
+    def _migrate(self):
+        """Create the schema, upgrading databases written by older versions"""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        legacy = version < 1 and self._has_table("subscriptions")
+        if legacy:
+            # Version 0 keyed subscriptions and snapshots by date window as well
+            self._conn.executescript("""
+                ALTER TABLE subscriptions RENAME TO subscriptions_v0;
+                DROP TABLE IF EXISTS availability_snapshots;
+            """)
+        self._conn.executescript(self.SCHEMA)
+        if legacy:
+            self._conn.executescript("""
+                INSERT OR REPLACE INTO subscriptions SELECT * FROM subscriptions_v0;
+                DROP TABLE subscriptions_v0;
+            """)
+        self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self._conn.commit()
+    
+    async def close(self):
+        """Flush pending writes and close the database"""
+        if self._conn is None:
+            return
+        await self.flush()
+        with self._conn_lock:
+            self._conn.close()
+            self._conn = None
+    
+    async def run(self):
+        """Background task: flush queued writes periodically or when the batch fills up"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                await self.prune()
+            except Exception as e:
+                logger.error("Failed to flush state store: %s", e)
+    
+    async def prune(self):
+        """Drop check results older than history_days, at most once per prune_interval"""
+        if self.history_days <= 0 or self._conn is None:
+            return
+        now = time.monotonic()
+        if self._last_prune is not None and now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        cutoff = (datetime.now() - timedelta(days=self.history_days)).isoformat()
+        async with self._flush_lock:
+            deleted = await asyncio.to_thread(self._delete_checks_before, cutoff)
+        if deleted:
+            logger.info("Pruned %d check results older than %d days", deleted, self.history_days)
+    
+    def _delete_checks_before(self, cutoff: str) -> int:
+        with self._conn_lock, self._conn:
+            return self._conn.execute("DELETE FROM check_results WHERE checked_at < ?", (cutoff,)).rowcount
+    
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending or self._conn is None:
+                return
+            batch, self._pending = self._pending, []
+            await asyncio.to_thread(self._write_batch, batch)
+    
+    def _write_batch(self, batch: List[Tuple[str, tuple]]):
+        with self._conn_lock, self._conn:
+            for sql, params in batch:
+                self._conn.execute(sql, params)
+    
+    def _enqueue(self, sql: str, params: tuple):
+        self._pending.append((sql, params))
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._conn_lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    # Writes (batched)
+    
+    def save_subscription(self, subscription: Subscription):
+        key = subscription.key
+        self._enqueue(
+            "INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?, ?, ?, ?)",
+            (subscription.chat_id, key.office_id, key.service_id, subscription.window_days,
+             subscription.interval_minutes, subscription.created_at.isoformat())
+        )
+    
+    def delete_subscriptions(self, chat_id: int):
+        self._enqueue("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+    
+    def save_snapshot(self, key: WatchKey, change: AvailabilityChange):
+        self._enqueue(
+            "INSERT OR REPLACE INTO availability_snapshots VALUES (?, ?, ?, ?, ?)",
+            (key.office_id, key.service_id, change.content_hash,
+             json.dumps(change.days.iso()), datetime.now().isoformat())
+        )
+    
+    def delete_snapshot(self, key: WatchKey):
+        self._enqueue(
+            "DELETE FROM availability_snapshots WHERE office_id = ? AND service_id = ?",
+            tuple(key)
+        )
+    
+    def record_check(self, key: WatchKey, window_days: int, success: bool, days_count: Optional[int],
+                     duration_ms: float, error: Optional[str] = None):
+        self._enqueue(
+            "INSERT INTO check_results (checked_at, office_id, service_id, window_days, "
+            "success, days_count, duration_ms, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (datetime.now().isoformat(), key.office_id, key.service_id, window_days,
+             int(success), days_count, duration_ms, error)
+        )
+    
+    def save_token(self, token: Optional[str], expires_at: Optional[datetime]):
+        self._enqueue(
+            "INSERT OR REPLACE INTO token_metadata VALUES (1, ?, ?, ?)",
+            (token, expires_at.isoformat() if expires_at else None, datetime.now().isoformat())
+        )
+    
+    # Reads (startup only)
+    
+    def load_subscriptions(self) -> List[Subscription]:
+        subscriptions = []
+        for chat_id, office_id, service_id, window_days, interval, created_at in self._query(
+                "SELECT * FROM subscriptions"):
+            subscription = Subscription(chat_id, WatchKey(office_id, service_id), interval, window_days)
+            subscription.created_at = datetime.fromisoformat(created_at)
+            subscriptions.append(subscription)
+        return subscriptions
+    
+    def load_snapshots(self) -> Dict[WatchKey, Tuple[bytes, AvailableDays]]:
+        return {
+            WatchKey(office_id, service_id): (content_hash, AvailableDays.from_iso(json.loads(days)))
+            for office_id, service_id, content_hash, days, _ in self._query(
+                "SELECT * FROM availability_snapshots")
+        }
+    
+    def load_token(self) -> Tuple[Optional[str], Optional[datetime]]:
+        rows = self._query("SELECT token, expires_at FROM token_metadata WHERE id = 1")
+        if not rows or not rows[0][1]:
+            return None, None
+        return rows[0][0], datetime.fromisoformat(rows[0][1])
+
+class ResponseRecorder:
+    """Appends raw availability responses to a gzip-compressed JSON-lines file.
+    
+    Each flush appends a separate gzip member, so a crash mid-flush only tears
+    the last one; read() stops there and everything before it can still be
+    replayed offline with replay.py.
+    """
+    def __init__(self, path: str, flush_interval: float = 5.0, batch_size: int = 200):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.recorded = 0
+        self._pending: List[bytes] = []
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+    
+    def record(self, key: WatchKey, window_days: int, status_code: int, raw: bytes):
+        line = json.dumps({
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "office_id": key.office_id,
+            "service_id": key.service_id,
+            "window_days": window_days,
+            "status": status_code,
+            "body": raw.decode("utf-8", errors="replace"),
+        }, ensure_ascii=False)
+        self._pending.append(line.encode() + b"\n")
+        self.recorded += 1
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+    
+    async def run(self):
+        """Background task: flush recorded responses periodically or when the batch fills up"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to write response recording: %s", e)
+    
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            await asyncio.to_thread(self._write_batch, batch)
+    
+    def _write_batch(self, batch: List[bytes]):
+        with gzip.open(self.path, "ab") as f:
+            f.write(b"".join(batch))
+    
+    @staticmethod
+    def read(path: str) -> Iterator[dict]:
+        """Yield recorded responses in file order, stopping at a torn trailing member"""
+        with gzip.open(path, "rb") as f:
+            try:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        raise EOFError("unterminated last line")
+                    if line.strip():
+                        yield json.loads(line)
+            except (EOFError, gzip.BadGzipFile) as e:
+                logger.warning("Recording %s ends in an incomplete or damaged member (%s), ignoring the rest", path, e)
+
 class MunichAppointmentBot:
-    def __init__(self, telegram_token: str, proxy_user: Optional[str] = None, proxy_password: Optional[str] = None):
+    def __init__(self, telegram_token: str, proxy_user: Optional[str] = None, proxy_password: Optional[str] = None,
+                 http_config: Optional[HttpClientConfig] = None, state_store: Optional[StateStore] = None,
+                 scheduler: Optional[PollScheduler] = None, request_filter: Optional[RequestFilter] = None,
+                 watch_targets: Optional[List[WatchKey]] = None, max_concurrent_checks: int = 4,
+                 api_base_url: Optional[str] = None, page_url: Optional[str] = None,
+                 telegram_base_url: Optional[str] = None, metrics_port: Optional[int] = None,
+                 metrics_host: str = "127.0.0.1", warmup: bool = True,
+                 recorder: Optional[ResponseRecorder] = None):
+        # Launch Chromium and solve a token in the background right after startup
+        self.startup = StartupTimer()
+        self.warmup = warmup
         self.telegram_token = telegram_token
-        self.application = ApplicationBuilder().token(telegram_token).build()
-        self.browser: Optional[Browser] = None
-        self.page: Optional[Page] = None
-        self.current_token: Optional[str] = None
-        self.token_expires_at: Optional[datetime] = None
-        self.is_monitoring = False
-        self.monitoring_interval = 5  # Default 5 minutes
-        self.chat_id: Optional[int] = None
+        builder = (
+            ApplicationBuilder()
+            .token(telegram_token)
+            .post_init(self._on_startup)
+            .post_stop(self._on_stop)
+            .post_shutdown(self._on_shutdown)
+        )
+        if telegram_base_url:
+            # e.g. a local stand-in for benchmarks (see mock_server.py)
+            builder = builder.base_url(telegram_base_url)
+        self.application = builder.build()
+        
+        # Every background task (monitors, token refresh, notifier...) runs under here
+        self.tasks = TaskSupervisor()
+        self.tokens = TokenManager(self._solve_fresh_token, on_token=self._persist_token,
+                                   poll_gap=lambda: (self.subscriptions.longest_interval() or 0) * 60,
+                                   spawn=functools.partial(self.tasks.spawn, report_errors=False))
+        self.default_interval = 5  # Default 5 minutes
+        
+        # Chats subscribed per watch key; the single polling task per key lives in self.tasks
+        self.subscriptions = SubscriptionRegistry()
+        self.availability = AvailabilityTracker()
+        self.scheduler = scheduler or PollScheduler()
+        
+        # Caps in-flight availability requests across all watch targets
+        self.check_semaphore = asyncio.Semaphore(max_concurrent_checks)
+        
+        # Optional persistence; without it all state is lost on restart
+        self.store = state_store
         
         # Proxy configuration
         self.proxy_config = None
         if proxy_user and proxy_password:
             self.proxy_config = ProxyConfig(proxy_user, proxy_password)
         
-        # Munich appointment system URLs and IDs
-        self.base_url = "https://www48.muenchen.de/buergeransicht/api/citizen"
-        self.office_id = "10187259"
-        self.service_id = "10339027"
+        # Long-lived Chromium used for captcha solving
+        self.browser_manager = BrowserManager(self.proxy_config)
+        self.request_filter = request_filter
+        self.last_page_load_stats: Optional[PageLoadStats] = None
+        
+        # Shared HTTP client, created on application startup
+        self.http_config = http_config or HttpClientConfig()
+        self.http_client: Optional[httpx.AsyncClient] = None
+        
+        # Cached egress IP, refreshed in the background (never on the check path)
+        self.egress_ip: Optional[str] = None
+        self.egress_ip_checked_at: Optional[datetime] = None
+        self.egress_ip_refresh_interval = 30 * 60  # seconds
+        
+        # Munich appointment system URLs and watch targets (office/service pairs)
+        self.base_url = api_base_url or "https://www48.muenchen.de/buergeransicht/api/citizen"
+        self.page_url = page_url or "https://stadt.muenchen.de/buergerservice/terminvereinbarung.html"
+        self.watch_targets = watch_targets or [WatchKey("10187259", "10339027")]
+        self.default_window_days = 180
         
         # Headers for API requests
         self.headers = {
             'Accept': '*/*',
             'Accept-Language': 'en-GB,en;q=0.9,en-US;q=0.8,tr;q=0.7',
-            'Connection': 'keep-alive',
             'Origin': 'https://stadt.muenchen.de',
             'Referer': 'https://stadt.muenchen.de/',
             'Sec-Fetch-Dest': 'empty',
@@ -79,20 +1622,206 @@ class MunichAppointmentBot:
             'sec-ch-ua-platform': '"macOS"'
         }
         
+        # Hot-path timing instrumentation, optionally exposed on a local HTTP endpoint
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self._metrics_server: Optional[asyncio.AbstractServer] = None
+        self._setup_metrics()
+        self.history = CheckHistory()
+        
+        # Optional capture of raw availability responses for offline replay
+        self.recorder = recorder
+        
+        # Outbound notifications are delivered by a background worker
+        self.notifier = NotificationQueue(self._send_telegram)
+        
         self._setup_handlers()
+        self.startup.mark("init")
+    
+    def _setup_metrics(self):
+        self.metrics = MetricsRegistry()
+        self.check_duration = self.metrics.histogram(
+            "appointment_check_duration_seconds", "Availability check latency by phase (token, api, total)")
+        self.token_refresh_duration = self.metrics.histogram(
+            "token_refresh_duration_seconds", "Duration of captcha token refreshes")
+        self.token_refresh_failures = self.metrics.counter(
+            "token_refresh_failures_total", "Failed captcha token refreshes")
+        self.telegram_send_duration = self.metrics.histogram(
+            "telegram_send_duration_seconds", "Telegram send_message latency")
+        self.polls = self.metrics.counter(
+            "watch_polls_total", "Monitoring ticks per watch target and outcome")
+        self.event_loop_lag = self.metrics.histogram(
+            "event_loop_lag_seconds", "How late a periodic event loop wake-up fires",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+        self.metrics.counter(
+            "browser_restarts_total", "Chromium relaunches after a crash",
+            callback=lambda: self.browser_manager.restarts)
+        self.metrics.gauge(
+            "active_watches", "Watch targets with a running polling task",
+            callback=lambda: len(self.monitor_tasks))
+        self.metrics.gauge(
+            "subscriptions", "Chat subscriptions across all watch targets",
+            callback=lambda: len(self.subscriptions))
+    
+    async def _event_loop_lag_loop(self, interval: float = 0.5):
+        """Measure how late a fixed sleep wakes up - a direct read of event-loop blocking"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.event_loop_lag.observe(max(0.0, time.perf_counter() - started - interval))
+    
+    async def _browser_watchdog_loop(self, interval: float = 60.0):
+        """Relaunch a crashed Chromium before the next token refresh runs into it"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.browser_manager.browser is not None and not await self.browser_manager.health_check():
+                    logger.warning("Chromium health check failed")
+            except Exception as e:
+                logger.error("Could not relaunch Chromium: %s", e)
+    
+    @property
+    def monitor_tasks(self) -> Dict[WatchKey, asyncio.Task]:
+        """Running polling task per watch target"""
+        return self.tasks.keyed
+    
+    async def _on_startup(self, application):
+        """Application post_init hook: open long-lived resources"""
+        self.startup.mark("telegram_connect")
+        self._get_http_client()
+        self.tasks.spawn(self._egress_ip_loop(), name="egress-ip")
+        self.tasks.spawn(self.tokens.run(), name="token-keeper")
+        self.tasks.spawn(self._event_loop_lag_loop(), name="loop-lag")
+        self.tasks.spawn(self._browser_watchdog_loop(), name="browser-watchdog")
+        self.tasks.spawn(self.notifier.run(), name="notifier")
+        if self.metrics_port:
+            self._metrics_server = await self.metrics.serve(self.metrics_host, self.metrics_port)
+        if self.store:
+            self.store.open()
+            self._restore_state()
+            self.tasks.spawn(self.store.run(), name="state-store")
+        if self.recorder:
+            self.tasks.spawn(self.recorder.run(), name="response-recorder")
+        self.startup.mark("restore")
+        # Polling starts as soon as this hook returns; nothing here waits for Chromium
+        logger.info("Ready to accept commands %.2fs after start", self.startup.elapsed())
+        if self.warmup:
+            self.tasks.spawn(self._report_startup(), name="warm-up")
+        else:
+            logger.info("Startup timing: %s", self.startup)
+    
+    async def _report_startup(self):
+        """Warm the browser and token while polling starts, then log the timing breakdown"""
+        await self._warm_up()
+        logger.info("Startup timing: %s (total %.2fs)", self.startup, self.startup.elapsed())
+    
+    async def _warm_up(self):
+        started = time.perf_counter()
+        try:
+            if self.tokens.is_valid():
+                # Token restored from the state store - only the next refresh needs Chromium
+                await self.browser_manager.start()
+            else:
+                # The solve reuses the browser being launched instead of starting its own
+                await asyncio.gather(self.browser_manager.start(), self.tokens.refresh())
+        except Exception as e:
+            logger.warning("Warm-up failed, token will be solved on first use: %s", e)
+        if self.browser_manager.last_launch_duration is not None:
+            self.startup.record("browser_launch", self.browser_manager.last_launch_duration)
+        if self.tokens.last_refresh_duration is not None:
+            self.startup.record("token", self.tokens.last_refresh_duration)
+        self.startup.record("warm_up", time.perf_counter() - started)
+    
+    async def _on_stop(self, application):
+        """Application post_stop hook: stop producing work, then flush notifications.
+        
+        Telegram updates have stopped but the bot is still initialized, so
+        queued messages can still be sent.
+        """
+        await self.tasks.cancel_named("monitor-", "token-", "warm-up")
+        # Give queued notifications a short chance to go out
+        try:
+            await asyncio.wait_for(self.notifier.join(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d undelivered notifications", self.notifier.pending())
+    
+    async def _on_shutdown(self, application):
+        """Application post_shutdown hook: stop the remaining loops, then release resources.
+        
+        Runs on the polling loop (also after SIGTERM), so the browser and
+        connection pools are closed on the loop that owns them.
+        """
+        await self.tasks.shutdown()
+        if self._metrics_server:
+            self._metrics_server.close()
+            await self._metrics_server.wait_closed()
+            self._metrics_server = None
+        if self.store:
+            await self.store.close()
+        if self.recorder:
+            await self.recorder.flush()
+        await self.browser_manager.close()
+        await self._close_http_client()
+    
+    def _restore_state(self):
+        """Reload persisted state and resume monitoring without user interaction"""
+        token, expires_at = self.store.load_token()
+        if token and expires_at and datetime.now() < expires_at:
+            self.tokens.set(token, expires_at)
+            logger.info("Restored captcha token from state store")
+        
+        for key, (content_hash, days) in self.store.load_snapshots().items():
+            self.availability.restore(key, content_hash, days)
+        
+        subscriptions = self.store.load_subscriptions()
+        for subscription in subscriptions:
+            self.subscriptions.subscribe(
+                subscription.chat_id, subscription.key, subscription.interval_minutes, subscription.window_days
+            )
+        for key in self.subscriptions.keys():
+            self._ensure_monitoring(key, initial_delay=self.scheduler.initial_delay())
+        if subscriptions:
+            # Polling resumes shortly, so keep the (restored) token fresh from the start
+            self.tokens.touch()
+            logger.info("Resumed %d subscriptions across %d watch targets",
+                        len(subscriptions), len(self.subscriptions.keys()))
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Return the shared pooled HTTP client, creating it on first use"""
+        if self.http_client is None or self.http_client.is_closed:
+            client_kwargs = {
+                'headers': self.headers,
+                'limits': self.http_config.get_limits(),
+                'timeout': self.http_config.get_timeout(),
+                'http2': self.http_config.http2_available(),
+            }
+            if self.proxy_config:
+                client_kwargs['proxy'] = self.proxy_config.get_httpx_proxy_url()
+                # Keep SSL verification enabled - BotProxy should handle SSL properly
+            self.http_client = httpx.AsyncClient(**client_kwargs)
+            logger.info("HTTP client ready (http2=%s, max_connections=%s)",
+                        client_kwargs['http2'], self.http_config.max_connections)
+        return self.http_client
+    
+    async def _close_http_client(self):
+        """Close the shared HTTP client and its connection pool"""
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
     
     def _setup_handlers(self):
         """Setup telegram bot command handlers"""
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("health", self.health_command))
+        self.application.add_handler(CommandHandler("stats", self.stats_command))
+        self.application.add_handler(CommandHandler("targets", self.targets_command))
         self.application.add_handler(CommandHandler("regular", self.regular_command))
         self.application.add_handler(CommandHandler("single", self.single_command))
         self.application.add_handler(CommandHandler("stop", self.stop_command))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
-        self.chat_id = update.effective_chat.id
         await update.message.reply_text(
             "🤖 Munich Appointment Bot Started!\n\n"
             "I'll help you monitor appointment availability for Munich services.\n"
@@ -101,38 +1830,143 @@ class MunichAppointmentBot:
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
-        help_text = """
+        help_text = f"""
 🤖 Munich Appointment Bot Commands:
 
 /start - Initialize the bot
 /help - Show this help message
 /health - Check bot status
-/single - Check for appointments once
-/regular <minutes> - Start regular monitoring (e.g., /regular 5)
+/stats - Show recent check statistics
+/targets - List the offices/services that can be watched
+/single [target] - Check for appointments once
+/regular <minutes> [days] [target] - Start regular monitoring (e.g., /regular 5 or /regular 5 30 2)
 /stop - Stop regular monitoring
 
 📍 Monitoring: Munich Bürgerservice appointments
-🏢 Office: Location 10187259
-🔧 Service: 10339027
+{self._format_targets()}
         """
         await update.message.reply_text(help_text)
     
+    async def targets_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /targets command"""
+        await update.message.reply_text(f"📍 Watch targets:\n{self._format_targets()}")
+    
+    def _format_targets(self) -> str:
+        return "\n".join(
+            f"{number}. 🏢 Office {key.office_id} - 🔧 Service {key.service_id}"
+            for number, key in enumerate(self.watch_targets, start=1)
+        )
+    
+    def _target_from_arg(self, arg: Optional[str]) -> WatchKey:
+        """Resolve a 1-based target number from /targets (default: first target)"""
+        if arg is None:
+            return self.watch_targets[0]
+        number = int(arg)
+        if not 1 <= number <= len(self.watch_targets):
+            raise ValueError(f"target must be between 1 and {len(self.watch_targets)}")
+        return self.watch_targets[number - 1]
+    
     async def health_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /health command"""
-        status = "✅ Running" if self.is_monitoring else "⏹️ Stopped"
-        token_status = "🟢 Valid" if self._is_token_valid() else "🔴 Expired/None"
+        chat_subscriptions = self.subscriptions.subscriptions_for_chat(update.effective_chat.id)
+        status = "✅ Running" if chat_subscriptions else "⏹️ Stopped"
+        interval = (
+            f"{min(sub.interval_minutes for sub in chat_subscriptions)} minutes"
+            if chat_subscriptions else "-"
+        )
+        token_status = "🟢 Valid" if self.tokens.is_valid() else "🔴 Expired/None"
+        bot_rss, browser_rss = await asyncio.to_thread(self._process_memory)
         
         health_info = f"""
 🏥 Bot Health Status:
 
 Status: {status}
 Token: {token_status}
-Monitoring Interval: {self.monitoring_interval} minutes
-Last Token Refresh: {self.token_expires_at.strftime('%H:%M:%S') if self.token_expires_at else 'Never'}
-Browser: {'🟢 Active' if self.browser else '🔴 Inactive'}
+Monitoring Interval: {interval}
+Active Watches: {len(self.monitor_tasks)} ({len(self.subscriptions)} subscriptions)
+Last Token Refresh: {self.tokens.last_refresh_at.strftime('%H:%M:%S') if self.tokens.last_refresh_at else 'Never'}
+Token Expires: {self.tokens.expires_at.strftime('%H:%M:%S') if self.tokens.expires_at else '-'}
+Browser: {'🟢 Active' if self.browser_manager.is_running else '🔴 Inactive'} (restarts: {self.browser_manager.restarts})
+Memory: bot {self._format_mb(bot_rss)}, browser {self._format_mb(browser_rss)}
+Pending Tasks: {len(asyncio.all_tasks())}
+Egress IP: {self.egress_ip or 'unknown'} ({'via proxy' if self.proxy_config else 'direct'}, checked {self.egress_ip_checked_at.strftime('%H:%M:%S') if self.egress_ip_checked_at else 'never'})
         """
         await update.message.reply_text(health_info)
     
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /stats command"""
+        outcomes = self.history.check_outcomes.values()
+        durations = self.history.check_durations.values()
+        refreshes = self.history.refresh_durations.values()
+        
+        if outcomes:
+            successes = sum(outcomes)
+            success_rate = f"{successes / len(outcomes) * 100:.1f}% ({successes}/{len(outcomes)})"
+            latency = (f"median {percentile(durations, 50) * 1000:.0f} ms, "
+                       f"p95 {percentile(durations, 95) * 1000:.0f} ms")
+        else:
+            success_rate = latency = "-"
+        if refreshes:
+            refresh = (f"last {refreshes[-1]:.1f}s, median {percentile(refreshes, 50):.1f}s "
+                       f"({len(refreshes)} refreshes)")
+        else:
+            refresh = "-"
+        if self.history.last_error:
+            last_error = f"{self.history.last_error} ({self.history.last_error_at.strftime('%H:%M:%S')})"
+        else:
+            last_error = "None"
+        
+        stats_info = f"""
+📊 Check Statistics (last {len(outcomes)} checks):
+
+Success Rate: {success_rate}
+Check Latency: {latency}
+Token Refresh: {refresh}
+Last Error: {last_error}
+        """
+        await update.message.reply_text(stats_info)
+    
+    @staticmethod
+    def _format_mb(rss_bytes: Optional[int]) -> str:
+        return f"{rss_bytes / 1024 / 1024:.0f} MB" if rss_bytes is not None else "n/a"
+    
+    @staticmethod
+    def _process_memory() -> Tuple[Optional[int], Optional[int]]:
+        """RSS of this process and of all its descendants (Playwright driver + Chromium).
+        
+        Reads /proc, so it only works on Linux (including the Docker image).
+        """
+        try:
+            page_size = os.sysconf("SC_PAGE_SIZE")
+            children: Dict[int, List[int]] = {}
+            for entry in os.listdir("/proc"):
+                if not entry.isdigit():
+                    continue
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        # The command name may contain spaces; fields resume after ')'
+                        ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                children.setdefault(ppid, []).append(int(entry))
+            
+            def rss(pid: int) -> int:
+                try:
+                    with open(f"/proc/{pid}/statm") as f:
+                        return int(f.read().split()[1]) * page_size
+                except (OSError, IndexError, ValueError):
+                    return 0
+            
+            own_pid = os.getpid()
+            descendants, stack = [], list(children.get(own_pid, []))
+            while stack:
+                pid = stack.pop()
+                descendants.append(pid)
+                stack.extend(children.get(pid, []))
+            return rss(own_pid), sum(rss(pid) for pid in descendants)
+        except (OSError, ValueError):
+            return None, None
+    
     async def regular_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /regular command"""
         try:
@@ -141,259 +1975,382 @@ Browser: {'🟢 Active' if self.browser else '🔴 Inactive'}
                 if minutes < 1:
                     await update.message.reply_text("❌ Interval must be at least 1 minute")
                     return
+                window_days = int(context.args[1]) if len(context.args) > 1 else self.default_window_days
+                if not 1 <= window_days <= self.default_window_days:
+                    await update.message.reply_text(
+                        f"❌ Date window must be between 1 and {self.default_window_days} days"
+                    )
+                    return
                 
-                self.monitoring_interval = minutes
-                self.chat_id = update.effective_chat.id
-                
-                if not self.is_monitoring:
-                    self.is_monitoring = True
-                    asyncio.create_task(self._start_monitoring())
+                key = self._target_from_arg(context.args[2] if len(context.args) > 2 else None)
+                subscription = self.subscriptions.subscribe(update.effective_chat.id, key, minutes, window_days)
+                if self.store:
+                    self.store.save_subscription(subscription)
+                self._ensure_monitoring(key)
                 
                 await update.message.reply_text(
                     f"✅ Regular monitoring started!\n"
-                    f"⏱️ Checking every {minutes} minutes"
+                    f"🏢 Office {key.office_id} - 🔧 Service {key.service_id}\n"
+                    f"⏱️ Checking every {minutes} minutes\n"
+                    f"📅 Looking {window_days} days ahead"
                 )
+                
+                # The shared poll only reports deltas, so show what is already known
+                known_days = self._days_in_window(self.availability.days(key) or AvailableDays(), subscription)
+                if known_days:
+                    await update.message.reply_text(
+                        f"🎉 APPOINTMENT AVAILABLE!\n{self._format_days(known_days)}"
+                    )
             else:
                 await update.message.reply_text(
                     "❌ Please specify interval in minutes\n"
                     "Example: /regular 5"
                 )
         except ValueError:
-            await update.message.reply_text("❌ Please provide a valid number of minutes")
+            await update.message.reply_text(
+                "❌ Please provide valid numbers for minutes, days and target (see /targets)"
+            )
     
     async def single_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /single command"""
-        self.chat_id = update.effective_chat.id
+        try:
+            key = self._target_from_arg(context.args[0] if context.args else None)
+        except ValueError:
+            await update.message.reply_text("❌ Unknown target, see /targets")
+            return
         await update.message.reply_text("🔍 Checking for appointments...")
         
         try:
-            result = await self._check_appointments()
-            if result:
+            change = await self._check_appointments(key, self.default_window_days)
+            if change.days:
                 await update.message.reply_text(
-                    f"🎉 APPOINTMENT AVAILABLE!\n{result}"
+                    f"🎉 APPOINTMENT AVAILABLE!\n{self._format_days(change.days)}"
                 )
             else:
                 await update.message.reply_text("😞 No appointments available")
         except Exception as e:
-            logger.error(f"Error during single check: {e}")
+            logger.error("Error during single check: %s", e)
             await update.message.reply_text(f"❌ Error checking appointments: {str(e)}")
     
     async def stop_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /stop command"""
-        self.is_monitoring = False
+        if self.store:
+            self.store.delete_subscriptions(update.effective_chat.id)
+        for key in self.subscriptions.unsubscribe(update.effective_chat.id):
+            # Last subscriber left - stop polling this key and wait for it to wind down
+            await self.tasks.cancel(key)
+            if self.subscriptions.has_subscribers(key):
+                # Someone subscribed again meanwhile and already has a fresh monitor
+                continue
+            self.availability.forget(key)
+            self.scheduler.forget(key)
+            if self.store:
+                self.store.delete_snapshot(key)
         await update.message.reply_text("⏹️ Regular monitoring stopped")
     
-    def _is_token_valid(self) -> bool:
-        """Check if current token is valid"""
-        if not self.current_token or not self.token_expires_at:
-            return False
-        return datetime.now() < self.token_expires_at
+    def _persist_token(self, token: str, expires_at: datetime):
+        """TokenManager callback: remember the token across restarts"""
+        if self.store:
+            self.store.save_token(token, expires_at)
     
-    async def _cleanup_browser_state(self):
-        """Clean up browser state for fresh token generation"""
-        if self.page:
-            try:
-                await self.page.context.clear_cookies()
-                await self.page.context.clear_permissions()
-                # Close current page to force fresh state
-                await self.page.close()
-                self.page = None
-                self.token_expires_at = None
-                self.current_token = None
-            except Exception as e:
-                logger.debug(f"Error cleaning browser state: {e}")
+    async def _solve_fresh_token(self) -> str:
+        """TokenManager solver: run the browser flow, recycling the context if it fails"""
+        started = time.perf_counter()
+        try:
+            with self.token_refresh_duration.time():
+                token = await self._solve_captcha()
+            self.history.record_refresh(time.perf_counter() - started)
+            return token
+        except Exception:
+            self.token_refresh_failures.inc()
+            await self.browser_manager.recycle_context()
+            raise
     
-    async def _start_monitoring(self):
-        """Start the monitoring loop"""
-        while self.is_monitoring:
+    def _ensure_monitoring(self, key: WatchKey, initial_delay: float = 0.0):
+        """Start the polling task for a key unless one is already running"""
+        self.tasks.ensure(key, lambda: self._start_monitoring(key, initial_delay), name=f"monitor-{key}")
+    
+    def _notify_chats(self, chat_ids: List[int], text: str):
+        """Queue the same message for several chats; delivery happens in the background"""
+        for chat_id in chat_ids:
+            self.notifier.enqueue(chat_id, text)
+    
+    async def _send_telegram(self, chat_id: int, text: str):
+        with self.telegram_send_duration.time():
+            await self.application.bot.send_message(chat_id=chat_id, text=text)
+    
+    @staticmethod
+    def _days_in_window(days: AvailableDays, subscription: Subscription) -> AvailableDays:
+        return days.until(subscription.last_day())
+    
+    async def _fan_out(self, key: WatchKey, change: AvailabilityChange):
+        """Notify each subscriber about the deltas that fall inside its own date window"""
+        # Days that merely slipped into the past did not get booked away; don't report them
+        upcoming_vanished = change.vanished.since(date.today())
+        for subscription in self.subscriptions.subscriptions(key):
+            opened = self._days_in_window(change.opened, subscription)
+            vanished = self._days_in_window(upcoming_vanished, subscription)
+            if opened:
+                self._notify_chats(
+                    [subscription.chat_id], f"🎉 APPOINTMENT AVAILABLE!\n{self._format_days(opened)}"
+                )
+            if vanished:
+                self._notify_chats(
+                    [subscription.chat_id], f"⌛ No longer available:\n{self._format_days(vanished)}"
+                )
+    
+    async def _apply_change(self, key: WatchKey, change: AvailabilityChange):
+        """Notify subscribers about a diff, then make it the new known state"""
+        if change.has_delta:
+            await self._fan_out(key, change)
+        if change.changed:
+            self.availability.commit(key, change)
+            if self.store:
+                self.store.save_snapshot(key, change)
+    
+    async def _start_monitoring(self, key: WatchKey, initial_delay: float = 0.0):
+        """Poll one watch key and fan results out to all of its subscribers"""
+        if initial_delay:
+            await asyncio.sleep(initial_delay)
+        while self.subscriptions.has_subscribers(key):
             try:
-                result = await self._check_appointments()
-                if result and self.chat_id:
-                    await self.application.bot.send_message(
-                        chat_id=self.chat_id,
-                        text=f"🎉 APPOINTMENT AVAILABLE!\n{result}"
-                    )
-                    # Stop monitoring after finding appointment
-                    self.is_monitoring = False
-                    await self.application.bot.send_message(
-                        chat_id=self.chat_id,
-                        text="✅ Monitoring stopped - appointment found!"
-                    )
-                    break
+                # One request over the merged window covers every subscriber of this target
+                window_days = self.subscriptions.window_for(key) or self.default_window_days
+                change = await self._check_appointments(key, window_days)
+                self.polls.inc(target=str(key), outcome="success")
+                await self._apply_change(key, change)
                 
-                # Wait for the specified interval
-                await asyncio.sleep(self.monitoring_interval * 60)
+                # Wait for the shortest interval requested by any subscriber
+                interval = self.subscriptions.interval_for(key) or self.default_interval
+                delay = self.scheduler.record_success(key, interval * 60)
                 
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
+                self.polls.inc(target=str(key), outcome="error")
                 error_message = str(e)
-                logger.error(f"Error in monitoring loop: {error_message}")
+                logger.error("Error in monitoring loop for %s: %s", key, error_message,
+                             extra={"target": str(key)})
+                retry_after = e.retry_after if isinstance(e, UpstreamHTTPError) else None
                 
                 # Check if this is a recoverable captcha token error
                 if "Invalid captcha token" in error_message or "captcha" in error_message.lower():
                     logger.info("Captcha token error detected - browser state cleaned, continuing monitoring...")
-                    # Short wait before retrying
-                    await asyncio.sleep(30)
+                    # Short base wait before retrying
+                    delay = self.scheduler.record_failure(key, 30, retry_after)
                 else:
-                    # For other errors, notify and wait longer
-                    if self.chat_id:
-                        await self.application.bot.send_message(
-                            chat_id=self.chat_id,
-                            text=f"❌ Monitoring error: {error_message}"
+                    # For other errors, back off from a longer base delay
+                    delay = self.scheduler.record_failure(key, 60, retry_after)
+                    # Notify once per failure streak rather than on every retry
+                    if self.scheduler.failure_count(key) == 1:
+                        self._notify_chats(
+                            self.subscriptions.subscribers(key),
+                            f"❌ Monitoring error: {error_message}"
                         )
-                    await asyncio.sleep(60)  # Wait 1 minute before retrying
-    
-    async def _init_browser(self):
-        """Initialize Playwright browser"""
-        if not self.browser:
-            playwright = await async_playwright().start()
-            
-            # Configure browser launch options with proxy if available
-            # Use headless=False when using proxy to avoid bot detection
-            launch_options = {"headless": True }
-            if self.proxy_config:
-                launch_options["proxy"] = self.proxy_config.get_playwright_proxy()
+                logger.info("Retrying %s in %.0fs", key, delay, extra={"target": str(key)})
             
-            self.browser = await playwright.chromium.launch(**launch_options)
-        
-        # Always create a new page for fresh captcha solving
-        if self.page:
-            await self.page.close()
-        self.page = await self.browser.new_page()
+            await asyncio.sleep(delay)
     
     async def _solve_captcha(self) -> str:
         """Solve the captcha via web automation and extract token"""
-        await self._init_browser()
-        
-        # Clear any existing cookies/cache for fresh start
-        await self.page.context.clear_cookies()
-        
-        # Store the token when we intercept the network response
-        captured_token = None
-        
-        async def handle_response(response):
-            nonlocal captured_token
-            # Intercept the captcha-verify response to get the token
-            if 'captcha-verify' in response.url:
-                try:
-                    data = await response.json()
-                    if data.get('token'):
-                        captured_token = data['token']
-                        logger.info("Captured token from network response")
-                except Exception as e:
-                    logger.debug(f"Could not parse response from {response.url}: {e}")
-        
-        # Set up response interception
-        self.page.on('response', handle_response)
-        
-        # Navigate to the appointment page
-        url = "https://stadt.muenchen.de/buergerservice/terminvereinbarung.html#/services/10339027/locations/10187259"
-        await self.page.goto(url)
-        
-        # Wait for captcha element to be visible (30 seconds)
-        await self.page.wait_for_selector('input[id="altcha_checkbox"]', timeout=30000)
-        
-        # Click the captcha checkbox - this will trigger the API calls
-        await self.page.click('input[id="altcha_checkbox"]')
-        
-        # Wait for captcha to be solved by the webpage (60 seconds for processing)
-        await self.page.wait_for_selector('[data-state="verified"]', timeout=60000)
-        
-        # Give a moment for the network request to complete
-        await asyncio.sleep(2)
-        
-        # Remove the response listener
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+        page = await self.browser_manager.new_page()
+        stats = PageLoadStats()
         try:
-            self.page.remove_listener('response', handle_response)
-        except Exception:
-            pass  # Ignore if listener was already removed
-        
-        if captured_token:
-            self.current_token = captured_token
-            self.token_expires_at = datetime.now() + timedelta(minutes=5)
-            logger.info(f"Successfully obtained captcha token")
-            return captured_token
-        else:
-            # Fallback: try to extract from page context
-            token = await self.page.evaluate("""
-                () => {
-                    // Try various ways to get the token from the page
-                    return localStorage.getItem('captchaToken') || 
-                           sessionStorage.getItem('captchaToken') ||
-                           window.captchaToken ||
-                           document.querySelector('[data-captcha-token]')?.getAttribute('data-captcha-token');
-                }
-            """)
+            # Clear any existing cookies for a fresh start (the context itself is reused)
+            await page.context.clear_cookies()
+            # Storage survives in the shared context too; wipe it before the page's own
+            # scripts run so the fallback below can never return an earlier solve's token
+            await page.add_init_script(
+                "try { localStorage.clear(); sessionStorage.clear(); } catch (e) {}"
+            )
+            
+            # Skip images, fonts, trackers etc. - only the captcha widget matters
+            if self.request_filter:
+                await page.route("**/*", lambda route: self.request_filter.handle(route, stats))
             
-            if token:
-                self.current_token = token
-                self.token_expires_at = datetime.now() + timedelta(minutes=5)
-                return token
+            # Navigate to the appointment page
+            started = time.perf_counter()
+            target = self.watch_targets[0]
+            url = f"{self.page_url}#/services/{target.service_id}/locations/{target.office_id}"
+            await page.goto(url)
+            
+            # Wait for captcha element to be visible (30 seconds)
+            await page.wait_for_selector('input[id="altcha_checkbox"]', timeout=30000)
+            widget_ready = time.perf_counter()
+            
+            # Click the captcha checkbox and wait for the captcha-verify response it
+            # triggers (60 seconds for processing) - that response carries the token
+            captured_token = None
+            try:
+                async with page.expect_response(
+                        lambda response: 'captcha-verify' in response.url, timeout=60000) as verify_info:
+                    await page.click('input[id="altcha_checkbox"]')
+                verify_response = await verify_info.value
+                data = await verify_response.json()
+                captured_token = data.get('token')
+            except PlaywrightTimeoutError:
+                logger.warning("No captcha-verify response within 60s")
+            except Exception as e:
+                logger.debug("Could not parse captcha-verify response: %s", e)
+            
+            logger.info("Captcha timings: page load %.1fs, verification %.1fs",
+                        widget_ready - started, time.perf_counter() - widget_ready)
+            
+            if captured_token:
+                logger.info("Successfully obtained captcha token")
+                return captured_token
             else:
-                raise Exception("Could not extract captcha token after solving")
+                # Fallback (verify response missing or without token): try the page context
+                token = await page.evaluate("""
+                    () => {
+                        // Try various ways to get the token from the page
+                        return localStorage.getItem('captchaToken') || 
+                               sessionStorage.getItem('captchaToken') ||
+                               window.captchaToken ||
+                               document.querySelector('[data-captcha-token]')?.getAttribute('data-captcha-token');
+                    }
+                """)
+                
+                if token:
+                    return token
+                else:
+                    raise Exception("Could not extract captcha token after solving")
+        finally:
+            if self.request_filter:
+                self.last_page_load_stats = stats
+                logger.info("Token page load: %s", stats)
+            try:
+                await page.close()
+            except Exception as e:
+                logger.debug("Error closing captcha page: %s", e)
     
     
-    async def _get_current_ip(self, client) -> str:
-        """Get current IP address for logging"""
+    async def _refresh_egress_ip(self):
+        """Resolve the egress IP (through the proxy, if configured) and cache it"""
         try:
+            client = self._get_http_client()
             response = await client.get("https://httpbin.org/ip", timeout=10.0)
-            ip_data = response.json()
-            return ip_data.get("origin", "unknown")
-        except Exception:
-            return "unknown"
+            ip = response.json().get("origin", "unknown")
+        except Exception as e:
+            logger.debug("Could not resolve egress IP: %s", e)
+            ip = "unknown"
+        
+        if ip != self.egress_ip:
+            proxy_status = "via proxy" if self.proxy_config else "direct connection"
+            logger.info("Egress IP: %s (%s)", ip, proxy_status)
+        self.egress_ip = ip
+        self.egress_ip_checked_at = datetime.now()
+    
+    async def _egress_ip_loop(self):
+        """Refresh the cached egress IP on a slow timer, independent of checks"""
+        while True:
+            await self._refresh_egress_ip()
+            await asyncio.sleep(self.egress_ip_refresh_interval)
     
-    async def _check_appointments(self) -> Optional[str]:
-        """Check for appointment availability"""
+    @staticmethod
+    def _format_days(days: AvailableDays) -> str:
+        return f"📅 {len(days)} {'date' if len(days) == 1 else 'dates'}:\n{days.format()}"
+    
+    @staticmethod
+    def _parse_available_days(raw: bytes) -> AvailableDays:
+        """Parse an available-days-by-office response into an AvailableDays set"""
+        data = loads_json(raw)
+        if "errors" in data:
+            error = data["errors"][0]
+            if error["errorCode"] == "noAppointmentForThisDay":
+                return AvailableDays()
+            raise Exception(f"API Error: {error['errorMessage']}")
+        
+        days = []
+        for entry in data.get("availableDays", []) if isinstance(data, dict) else data:
+            # Entries are either plain dates or objects like {"time": "2025-01-31", ...}
+            day = entry if isinstance(entry, str) else entry.get("time") or entry.get("date")
+            if day:
+                days.append(day)
+        return AvailableDays.from_iso(days)
+    
+    async def _check_appointments(self, key: Optional[WatchKey] = None,
+                                  window_days: Optional[int] = None) -> AvailabilityChange:
+        """Check for appointment availability and diff it against the last known state"""
+        if key is None:
+            key = self.watch_targets[0]
+        if window_days is None:
+            window_days = self.default_window_days
+        started = time.perf_counter()
         try:
-            # Ensure we have a valid token
-            if not self._is_token_valid():
-                logger.info("Token expired or invalid, refreshing...")
-                await self._cleanup_browser_state()
-                await self._solve_captcha()
+            # Usually served from the background-refreshed token without waiting
+            with self.check_duration.time(phase="token"):
+                token = await self.tokens.get_token()
             
             # Make the appointment availability request
             start_date = datetime.now().strftime("%Y-%m-%d")
-            end_date = (datetime.now() + timedelta(days=180)).strftime("%Y-%m-%d")
+            end_date = (datetime.now() + timedelta(days=window_days)).strftime("%Y-%m-%d")
             
             url = f"{self.base_url}/available-days-by-office/"
             params = {
                 'startDate': start_date,
                 'endDate': end_date,
-                'officeId': self.office_id,
-                'serviceId': self.service_id,
+                'officeId': key.office_id,
+                'serviceId': key.service_id,
                 'serviceCount': '1',
-                'captchaToken': self.current_token
+                'captchaToken': token
             }
             
-            # Create httpx client with proxy if configured
-            client_kwargs = {}
-            if self.proxy_config:
-                client_kwargs['proxy'] = self.proxy_config.get_httpx_proxy_url()
-                # Keep SSL verification enabled - BotProxy should handle SSL properly
+            # Reuse the pooled client so keep-alive connections survive between checks
+            client = self._get_http_client()
             
-            async with httpx.AsyncClient(**client_kwargs) as client:
-                # Log current IP address for monitoring
-                current_ip = await self._get_current_ip(client)
-                proxy_status = "via proxy" if self.proxy_config else "direct connection"
-                logger.info(f"Making appointment request from IP: {current_ip} ({proxy_status})")
-                
-                response = await client.get(url, headers=self.headers, params=params)
-                data = response.json()
-                
-                # Check if appointments are available
-                if "errors" not in data and data:
-                    return f"Available dates: {data}"
-                elif "errors" in data:
-                    error = data["errors"][0]
-                    if error["errorCode"] == "noAppointmentForThisDay":
-                        return None
-                    else:
-                        raise Exception(f"API Error: {error['errorMessage']}")
-                else:
-                    return None
+            # Log the cached egress IP - resolved in the background, never awaited here
+            proxy_status = "via proxy" if self.proxy_config else "direct connection"
+            logger.debug("Making appointment request from IP: %s (%s)", self.egress_ip or "unknown", proxy_status)
+            
+            # Bound in-flight requests, then respect the global budget and any Retry-After pause
+            async with self.check_semaphore:
+                await self.scheduler.acquire()
+                with self.check_duration.time(phase="api"):
+                    response = await client.get(url, params=params)
+            if self.recorder:
+                self.recorder.record(key, window_days, response.status_code, response.content)
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = UpstreamHTTPError.parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    # Applies to monitors and /single alike, so pause here rather than in the loop
+                    self.scheduler.pause(retry_after)
+                raise UpstreamHTTPError(response.status_code, retry_after)
+            
+            # Unchanged responses short-circuit on the hash and are not parsed again
+            change = self.availability.diff(key, response.content, self._parse_available_days)
+            duration = time.perf_counter() - started
+            self.check_duration.observe(duration, phase="total")
+            self.history.record_check(duration, True)
+            fields = {
+                "target": str(key), "window_days": window_days, "days": len(change.days),
+                "duration_ms": round(duration * 1000, 1), "token_age_s": self.tokens.age(),
+            }
+            if change.has_delta:
+                logger.info("Availability changed for %s: %d days available", key, len(change.days),
+                            extra={**fields, "outcome": "changed"})
+            else:
+                # Repeats every poll; sampled when LOG_SAMPLE_INTERVAL is set
+                outcome = "available" if change.days else "none"
+                logger.info("No new appointments for %s (%d days available)", key, len(change.days),
+                            extra={**fields, "outcome": outcome, "sample_key": f"check:{key}"})
+            if self.store:
+                self.store.record_check(key, window_days, True, len(change.days), duration * 1000)
+            return change
                     
         except Exception as e:
-            logger.error(f"Error checking appointments: {e}")
-            await self._cleanup_browser_state()
+            duration = time.perf_counter() - started
+            logger.error("Error checking appointments for %s: %s", key, e,
+                         extra={"target": str(key), "window_days": window_days, "outcome": "error",
+                                "duration_ms": round(duration * 1000, 1), "token_age_s": self.tokens.age()})
+            self.history.record_check(duration, False, str(e))
+            if self.store:
+                self.store.record_check(key, window_days, False, None, duration * 1000, str(e))
+            if not isinstance(e, (UpstreamHTTPError, httpx.HTTPError)):
+                # API errors usually mean a rejected token; transport errors,
+                # rate limits and server errors say nothing about it
+                self.tokens.invalidate()
             
             # For single checks, re-raise the exception
             # For monitoring, we'll handle this in the monitoring loop
@@ -406,12 +2363,12 @@ Browser: {'🟢 Active' if self.browser else '🔴 Inactive'}
             self.application.run_polling()
         except KeyboardInterrupt:
             logger.info("Shutting down bot...")
-        finally:
-            if self.browser:
-                asyncio.run(self.browser.close())
 
 def main():
-    import os
+    # Optional JSON output, off-loop log I/O and sampling of per-poll lines
+    log_format = os.getenv("LOG_FORMAT", "text").lower()
+    log_queue = os.getenv("LOG_ASYNC", "true" if log_format == "json" else "false").lower() in ("true", "1", "yes", "on")
+    log_listener = configure_logging(log_format, log_queue, float(os.getenv("LOG_SAMPLE_INTERVAL", "0")))
     
     # Get Telegram bot token from environment
     token = os.getenv("TELEGRAM_BOT_TOKEN", "8302207568:AAHihP2Ak_TXpMR8HLrhubGUwZYtw1AUZ2s")
@@ -423,17 +2380,67 @@ def main():
     proxy_user = os.getenv("BOTPROXY_USER")
     proxy_password = os.getenv("BOTPROXY_PASSWORD")
     
+    # Connection pool / timeout settings for the shared HTTP client
+    http_config = HttpClientConfig.from_env()
+    
+    # Persist subscriptions and history unless explicitly disabled
+    state_db_path = os.getenv("STATE_DB_PATH", "bot_state.db")
+    history_days = int(os.getenv("STATE_HISTORY_DAYS", "30"))
+    state_store = StateStore(state_db_path, history_days=history_days) if state_db_path else None
+    
+    # Offices/services that can be watched; the first one is the default
+    watch_targets = WatchKey.parse_list(os.getenv("WATCH_TARGETS", "10187259:10339027"))
+    max_concurrent_checks = int(os.getenv("MAX_CONCURRENT_CHECKS", "4"))
+    
+    # Local Prometheus endpoint (disabled unless METRICS_PORT is set)
+    metrics_port = int(os.getenv("METRICS_PORT", "0")) or None
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+    
+    # Record raw availability responses for replay.py (disabled unless set)
+    record_path = os.getenv("RECORD_RESPONSES_PATH")
+    recorder = ResponseRecorder(record_path) if record_path else None
+    
+    # Launch Chromium and solve the first token right away instead of on first use
+    warmup = os.getenv("STARTUP_WARMUP", "true").lower() in ("true", "1", "yes", "on")
+    
+    # Endpoint overrides, e.g. to point the bot at mock_server.py
+    endpoints = {
+        'api_base_url': os.getenv("MUNICH_API_BASE_URL"),
+        'page_url': os.getenv("MUNICH_PAGE_URL"),
+        'telegram_base_url': os.getenv("TELEGRAM_API_BASE_URL"),
+    }
+    
+    # Jitter, backoff and global request budget for polling
+    scheduler = PollScheduler.from_env()
+    
+    # Trim the token page load unless disabled
+    block_enabled = os.getenv("BROWSER_REQUEST_FILTER", "true").lower() in ("true", "1", "yes", "on")
+    request_filter = RequestFilter.from_env() if block_enabled else None
+    
     if proxy_enabled and proxy_user and proxy_password:
         logger.info("Using BotProxy for requests")
-        bot = MunichAppointmentBot(token, proxy_user=proxy_user, proxy_password=proxy_password)
+        bot = MunichAppointmentBot(token, proxy_user=proxy_user, proxy_password=proxy_password,
+                                   http_config=http_config, state_store=state_store,
+                                   scheduler=scheduler, request_filter=request_filter,
+                                   watch_targets=watch_targets, max_concurrent_checks=max_concurrent_checks,
+                                   metrics_port=metrics_port, metrics_host=metrics_host, warmup=warmup,
+                                   recorder=recorder, **endpoints)
     else:
         if not proxy_enabled:
             logger.info("Proxy disabled via USE_PROXY environment variable")
         elif not proxy_user or not proxy_password:
             logger.info("No proxy credentials found, running without proxy")
-        bot = MunichAppointmentBot(token)
+        bot = MunichAppointmentBot(token, http_config=http_config, state_store=state_store,
+                                   scheduler=scheduler, request_filter=request_filter,
+                                   watch_targets=watch_targets, max_concurrent_checks=max_concurrent_checks,
+                                   metrics_port=metrics_port, metrics_host=metrics_host, warmup=warmup,
+                                   recorder=recorder, **endpoints)
     
-    bot.run()
+    try:
+        bot.run()
+    finally:
+        if log_listener:
+            log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for Munich Appointment Bot
+
+Drives _check_appointments, the monitoring loop, the Telegram send path and
+(optionally) the Playwright token refresh against mock_server.py and reports
+p50/p95/p99 latency, throughput and memory per scenario. No traffic is sent
+to the real Munich or Telegram servers.
+
+Usage:
+    python benchmark.py --checks 500 --concurrency 8 --targets 5 --duration 10
+    python benchmark.py --json bench.json --fail-above check:250
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Optional
+
+from appointment_bot import MunichAppointmentBot, PollScheduler, WatchKey, percentile
+from mock_server import API_PREFIX, PAGE_PATH, MockConfig, start_mock_server
+
+class BenchmarkScheduler(PollScheduler):
+    """Schedules ticks back-to-back so the loop itself is what gets measured"""
+    def record_success(self, key, interval):
+        super().record_success(key, interval)
+        return 0.0
+
+    def record_failure(self, key, base_delay, retry_after=None):
+        super().record_failure(key, base_delay)
+        return 0.01
+
+class ScenarioResult:
+    def __init__(self, name: str, samples, elapsed: float, peak_bytes: Optional[int], errors: int = 0):
+        self.name = name
+        self.samples = sorted(samples)
+        self.elapsed = elapsed
+        self.peak_bytes = peak_bytes
+        self.errors = errors
+
+    def percentile(self, p: float) -> float:
+        """Nearest-rank percentile in milliseconds"""
+        if not self.samples:
+            return 0.0
+        return percentile(self.samples, p) * 1000
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "count": len(self.samples),
+            "errors": self.errors,
+            "p50_ms": round(self.percentile(50), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2),
+            "throughput_per_s": round(len(self.samples) / self.elapsed, 2) if self.elapsed else 0.0,
+            "peak_python_mb": round(self.peak_bytes / 1024 / 1024, 2) if self.peak_bytes is not None else None,
+        }
+
+async def timed(samples, coro):
+    started = time.perf_counter()
+    await coro
+    samples.append(time.perf_counter() - started)
+
+async def run_scenario(name: str, body) -> ScenarioResult:
+    """Run one scenario body(samples) and collect timing and allocation peak"""
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    samples = []
+    started = time.perf_counter()
+    errors = await body(samples)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if tracing else None
+    return ScenarioResult(name, samples, elapsed, peak, errors or 0)
+
+async def bench_checks(bot, key, count: int, concurrency: int) -> ScenarioResult:
+    async def body(samples):
+        errors = 0
+        queue = iter(range(count))
+
+        async def worker():
+            nonlocal errors
+            for _ in queue:
+                try:
+                    await timed(samples, bot._check_appointments(key))
+                except Exception:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return errors
+    return await run_scenario("check", body)
+
+async def bench_monitoring(bot, server, targets, subscribers: int, duration: float) -> ScenarioResult:
+    """Poll every target back-to-back with churning availability and fan-out to all subscribers"""
+    # Measure what the real loop does: time from check start to end of fan-out
+    async def body(samples):
+        original_check = bot._check_appointments
+        original_fan_out = bot._fan_out
+        tick_started = {}
+
+        async def check(key, window_days=None):
+            tick_started[key] = time.perf_counter()
+            change = await original_check(key, window_days)
+            if not change.has_delta:
+                samples.append(time.perf_counter() - tick_started[key])
+            return change
+
+        async def fan_out(key, change):
+            await original_fan_out(key, change)
+            samples.append(time.perf_counter() - tick_started[key])
+
+        for key in targets:
+            for chat_id in range(subscribers):
+                bot.subscriptions.subscribe(1000 + chat_id, key, 1, 30 + chat_id % 150)
+
+        server.state.config.churn = 0.3
+        bot._check_appointments = check
+        bot._fan_out = fan_out
+        for key in targets:
+            bot._ensure_monitoring(key)
+        await asyncio.sleep(duration)
+        await asyncio.gather(*(bot.tasks.cancel(key) for key in targets))
+        bot._check_appointments = original_check
+        bot._fan_out = original_fan_out
+        server.state.config.churn = 0.0
+        for key in targets:
+            bot.subscriptions.remove_key(key)
+        return 0
+
+    return await run_scenario("monitor_tick", body)
+
+async def bench_telegram(bot, count: int) -> ScenarioResult:
+    async def body(samples):
+        for i in range(count):
+            await timed(samples, bot.notifier.deliver(2000 + i % 50, f"🎉 APPOINTMENT AVAILABLE!\nbenchmark {i}"))
+        return 0
+    return await run_scenario("telegram_send", body)
+
+async def bench_token_refresh(bot, count: int) -> ScenarioResult:
+    async def body(samples):
+        errors = 0
+        for _ in range(count):
+            try:
+                await timed(samples, bot.tokens.refresh())
+            except Exception as e:
+                logging.getLogger(__name__).warning("Token refresh failed: %s", e)
+                errors += 1
+        return errors
+    return await run_scenario("token_refresh", body)
+
+def print_report(results, rss_mb: float):
+    print()
+    print(f"{'scenario':<16}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak MB':>10}")
+    print("-" * 82)
+    for result in results:
+        row = result.as_dict()
+        peak = f"{row['peak_python_mb']:.2f}" if row['peak_python_mb'] is not None else "-"
+        print(f"{row['name']:<16}{row['count']:>8}{row['errors']:>8}{row['p50_ms']:>10.1f}"
+              f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['throughput_per_s']:>10.1f}"
+              f"{peak:>10}")
+    print(f"\nMax RSS: {rss_mb:.1f} MB")
+
+async def run(args) -> int:
+    config = MockConfig(
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_ms / 4,
+        error_rate=args.error_rate, days=args.days, static_kb=args.static_kb
+    )
+    server, base_url = start_mock_server(config)
+    targets = [WatchKey(str(10187259 + i), "10339027") for i in range(args.targets)]
+    bot = MunichAppointmentBot(
+        "123456:benchmark",
+        scheduler=BenchmarkScheduler(jitter=0, startup_spread=0),
+        watch_targets=targets,
+        max_concurrent_checks=args.concurrency,
+        api_base_url=f"{base_url}{API_PREFIX}",
+        page_url=f"{base_url}{PAGE_PATH}",
+        telegram_base_url=f"{base_url}/bot",
+    )
+    await bot.application.initialize()
+    bot.tasks.spawn(bot.notifier.run(), name="notifier")
+
+    results = []
+    try:
+        if args.token_refreshes:
+            results.append(await bench_token_refresh(bot, args.token_refreshes))
+        else:
+            # Skip the browser: hand out a token the mock will accept
+            bot.tokens.set(server.state.issue_token(), datetime.now() + timedelta(hours=1))
+
+        if args.checks:
+            results.append(await bench_checks(bot, targets[0], args.checks, args.concurrency))
+        if args.duration:
+            results.append(await bench_monitoring(bot, server, targets, args.subscribers, args.duration))
+        if args.sends:
+            results.append(await bench_telegram(bot, args.sends))
+    finally:
+        await bot.tasks.shutdown()
+        await bot.browser_manager.close()
+        await bot._close_http_client()
+        await bot.application.shutdown()
+        server.shutdown()
+
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print_report(results, rss_mb)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": [r.as_dict() for r in results], "max_rss_mb": round(rss_mb, 1),
+                       "mock_counters": server.state.counters}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+    # Regression gate for CI: --fail-above scenario:p95_ms
+    failed = False
+    by_name = {r.name: r for r in results}
+    for threshold in args.fail_above:
+        name, _, limit = threshold.partition(":")
+        result = by_name.get(name)
+        if result and result.percentile(95) > float(limit):
+            print(f"❌ {name} p95 {result.percentile(95):.1f} ms exceeds {limit} ms")
+            failed = True
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot against the local mock server")
+    parser.add_argument("--checks", type=int, default=200, help="Number of single availability checks")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent checks / in-flight limit")
+    parser.add_argument("--targets", type=int, default=3, help="Watch targets for the monitoring scenario")
+    parser.add_argument("--subscribers", type=int, default=20, help="Chats subscribed to every target")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run the monitoring loop (0 = skip)")
+    parser.add_argument("--sends", type=int, default=100, help="Telegram messages to send")
+    parser.add_argument("--token-refreshes", type=int, default=0,
+                        help="Playwright token refreshes against the mock page (needs Chromium)")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Mock server response latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of availability calls failing with 500")
+    parser.add_argument("--days", type=int, default=30, help="Available days per response")
+    parser.add_argument("--static-kb", type=int, default=200, help="Size of static assets on the mock page")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--fail-above", action="append", default=[], metavar="SCENARIO:P95_MS",
+                        help="Exit non-zero if a scenario's p95 latency exceeds the limit")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Track peak Python allocations per scenario (tracemalloc; slows everything down)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger("appointment_bot").setLevel(logging.WARNING)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    sys.exit(asyncio.run(run(args)))
+
+if __name__ == "__main__":
+    main()
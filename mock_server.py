@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Munich citizen API, the appointment page and the Telegram Bot API
+
+Serves the endpoints the bot talks to so checks, token refreshes and
+notifications can be exercised and benchmarked offline, without sending a
+single request to www48.muenchen.de, stadt.muenchen.de or api.telegram.org.
+
+Usage:
+    python mock_server.py --port 8080 --latency-ms 80 --error-rate 0.02 --days 40
+
+Point the bot at it with:
+    MUNICH_API_BASE_URL=http://127.0.0.1:8080/buergeransicht/api/citizen
+    MUNICH_PAGE_URL=http://127.0.0.1:8080/buergerservice/terminvereinbarung.html
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8080/bot
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+API_PREFIX = "/buergeransicht/api/citizen"
+PAGE_PATH = "/buergerservice/terminvereinbarung.html"
+
+APPOINTMENT_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+  <title>Terminvereinbarung (mock)</title>
+  <link rel="stylesheet" href="/static/site.css">
+  <script src="/static/bundle.js"></script>
+</head>
+<body>
+  <img src="/static/logo.png" alt="logo">
+  <div id="altcha" data-state="unverified">
+    <input type="checkbox" id="altcha_checkbox">
+  </div>
+  <script>
+    const api = "__API_PREFIX__";
+    document.getElementById("altcha_checkbox").addEventListener("click", async () => {
+      await fetch(api + "/captcha-details/");
+      const challenge = await (await fetch(api + "/captcha-challenge/")).json();
+      const response = await fetch(api + "/captcha-verify/", {
+        method: "POST",
+        headers: {"Content-Type": "application/json"},
+        body: JSON.stringify({payload: challenge.challenge})
+      });
+      const data = await response.json();
+      localStorage.setItem("captchaToken", data.token);
+      document.getElementById("altcha").dataset.state = "verified";
+    });
+  </script>
+</body>
+</html>
+""".replace("__API_PREFIX__", API_PREFIX)
+
+class MockConfig:
+    """Behaviour knobs for the mock server"""
+    def __init__(self, latency_ms: float = 50.0, latency_jitter_ms: float = 20.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: int = 5,
+                 days: int = 20, churn: float = 0.0, verify_delay_ms: float = 200.0,
+                 static_kb: int = 200, validate_tokens: bool = True):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.days = days
+        self.churn = churn
+        self.verify_delay_ms = verify_delay_ms
+        self.static_kb = static_kb
+        self.validate_tokens = validate_tokens
+
+class MockState:
+    """Mutable server state shared across handler threads"""
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.tokens = set()
+        self.counters = {}
+        self.message_id = 0
+        self.days = self._initial_days()
+
+    def _initial_days(self):
+        today = datetime.now().date()
+        offsets = random.sample(range(1, 180), min(self.config.days, 179))
+        return {(today + timedelta(days=offset)).isoformat() for offset in offsets}
+
+    def count(self, name: str):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def next_days(self):
+        """Current availability; with churn > 0 some days open/close on every call"""
+        with self.lock:
+            if self.config.churn and random.random() < self.config.churn:
+                if self.days and random.random() < 0.5:
+                    self.days.discard(random.choice(sorted(self.days)))
+                else:
+                    today = datetime.now().date()
+                    self.days.add((today + timedelta(days=random.randint(1, 179))).isoformat())
+            return sorted(self.days)
+
+    def issue_token(self) -> str:
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens.add(token)
+        return token
+
+    def next_message_id(self) -> int:
+        with self.lock:
+            self.message_id += 1
+            return self.message_id
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection pooling is measurable
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    state: MockState = None
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def _simulate_latency(self):
+        config = self.state.config
+        delay = config.latency_ms + random.uniform(-config.latency_jitter_ms, config.latency_jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload, headers=None):
+        self._send(status, json.dumps(payload).encode(), headers=headers)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def _route(self, method: str):
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = parse_qs(parts.query)
+        body = self._read_body() if method == "POST" else b""
+
+        if path.startswith(API_PREFIX):
+            self._handle_api(path[len(API_PREFIX):], query)
+        elif path == PAGE_PATH:
+            self.state.count("page")
+            self._send(200, APPOINTMENT_PAGE.encode(), "text/html")
+        elif path.startswith("/static/"):
+            self._handle_static(path)
+        elif path.startswith("/bot"):
+            self._handle_telegram(path, body)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _handle_api(self, endpoint: str, query):
+        config = self.state.config
+        self._simulate_latency()
+
+        if endpoint.startswith("/captcha-details"):
+            self.state.count("captcha-details")
+            self._send_json(200, {"siteKey": "mock", "captchaEnabled": True})
+        elif endpoint.startswith("/captcha-challenge"):
+            self.state.count("captcha-challenge")
+            self._send_json(200, {"algorithm": "SHA-256", "challenge": uuid.uuid4().hex, "maxnumber": 1000})
+        elif endpoint.startswith("/captcha-verify"):
+            self.state.count("captcha-verify")
+            time.sleep(config.verify_delay_ms / 1000)
+            self._send_json(200, {"meta": {"success": True}, "token": self.state.issue_token()})
+        elif endpoint.startswith("/available-days-by-office"):
+            self.state.count("available-days")
+            roll = random.random()
+            if roll < config.rate_limit_rate:
+                self.state.count("available-days-429")
+                self._send_json(429, {"errors": [{"errorCode": "tooManyRequests"}]},
+                                headers={"Retry-After": str(config.retry_after)})
+                return
+            if roll < config.rate_limit_rate + config.error_rate:
+                self.state.count("available-days-500")
+                self._send_json(500, {"errors": [{"errorCode": "internalError"}]})
+                return
+            token = (query.get("captchaToken") or [""])[0]
+            if config.validate_tokens and token not in self.state.tokens:
+                self._send_json(400, {"errors": [{"errorCode": "captchaVerificationError",
+                                                  "errorMessage": "Invalid captcha token"}]})
+                return
+
+            days = self.state.next_days()
+            if not days:
+                self._send_json(404, {"errors": [{"errorCode": "noAppointmentForThisDay",
+                                                  "errorMessage": "No appointments"}]})
+                return
+            office_id = (query.get("officeId") or [""])[0]
+            self._send_json(200, {
+                "availableDays": [{"time": day, "providerIDs": office_id} for day in days],
+                "lastModified": int(time.time())
+            })
+        else:
+            self._send_json(404, {"errors": [{"errorCode": "notFound", "errorMessage": endpoint}]})
+
+    def _handle_static(self, path: str):
+        self.state.count("static")
+        size = self.state.config.static_kb * 1024
+        if path.endswith(".js"):
+            self._send(200, b"/*" + b" " * max(0, size - 4) + b"*/", "application/javascript")
+        elif path.endswith(".css"):
+            self._send(200, b"body{}" + b" " * max(0, size - 6), "text/css")
+        else:
+            self._send(200, b"\x89PNG" + b"\0" * max(0, size - 4), "image/png")
+
+    def _handle_telegram(self, path: str, body: bytes):
+        method = path.rsplit("/", 1)[-1]
+        self.state.count(f"telegram-{method}")
+        self._simulate_latency()
+        if method == "getMe":
+            self._send_json(200, {"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "Mock", "username": "mock_bot",
+                "can_join_groups": True, "can_read_all_group_messages": False,
+                "supports_inline_queries": False
+            }})
+        elif method == "sendMessage":
+            params = self._parse_params(body)
+            chat_id = int(params.get("chat_id", 0))
+            self._send_json(200, {"ok": True, "result": {
+                "message_id": self.state.next_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", "")
+            }})
+        elif method == "getUpdates":
+            # No incoming messages; lets the real run_polling loop run against the mock
+            self._send_json(200, {"ok": True, "result": []})
+        else:
+            self._send_json(200, {"ok": True, "result": True})
+
+    def _parse_params(self, body: bytes) -> dict:
+        content_type = self.headers.get("Content-Type", "")
+        if "application/json" in content_type:
+            return json.loads(body or b"{}")
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (cancelled benchmark tasks) are expected
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+def start_mock_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0):
+    """Start the mock server in a background thread; returns (server, base_url)"""
+    state = MockState(config)
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = MockHTTPServer((host, port), handler)
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}"
+    return server, base_url
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Munich citizen API and Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mean response latency")
+    parser.add_argument("--latency-jitter-ms", type=float, default=20.0, help="Uniform latency jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of availability calls answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share answered with 429 + Retry-After")
+    parser.add_argument("--retry-after", type=int, default=5, help="Retry-After seconds sent with 429")
+    parser.add_argument("--days", type=int, default=20, help="Number of available days (response size)")
+    parser.add_argument("--churn", type=float, default=0.0, help="Chance per call that a day opens or closes")
+    parser.add_argument("--verify-delay-ms", type=float, default=200.0, help="Extra delay on captcha-verify")
+    parser.add_argument("--static-kb", type=int, default=200, help="Size of each static asset on the page")
+    parser.add_argument("--no-token-check", action="store_true", help="Accept any captcha token")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        days=args.days, churn=args.churn, verify_delay_ms=args.verify_delay_ms,
+        static_kb=args.static_kb, validate_tokens=not args.no_token_check
+    )
+    server, base_url = start_mock_server(config, args.host, args.port)
+    print(f"🧪 Mock server listening on {base_url}")
+    print(f"   MUNICH_API_BASE_URL={base_url}{API_PREFIX}")
+    print(f"   MUNICH_PAGE_URL={base_url}{PAGE_PATH}")
+    print(f"   TELEGRAM_API_BASE_URL={base_url}/bot")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print("\nStopping mock server")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Offline replay of recorded availability responses
+
+Feeds a recording made with RECORD_RESPONSES_PATH through the bot's real
+parse -> diff -> fan-out -> notification path as fast as possible and reports
+throughput and per-response latency. Telegram is stubbed; nothing is sent to
+the city's servers or to api.telegram.org.
+
+Usage:
+    python replay.py responses.jsonl.gz --subscribers 50
+    python replay.py responses.jsonl.gz --repeat 20 --profile replay.prof --top 25
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import logging
+import pstats
+import sys
+import time
+
+from appointment_bot import (AvailabilityTracker, MunichAppointmentBot, NotificationQueue,
+                             ResponseRecorder, WatchKey, percentile)
+
+class StubTelegram:
+    """Counts messages instead of sending them"""
+    def __init__(self):
+        self.messages = 0
+        self.chars = 0
+
+    async def send(self, chat_id: int, text: str):
+        self.messages += 1
+        self.chars += len(text)
+
+def load_records(path: str, limit: int = 0):
+    """Read a recording into (key, raw body) pairs.
+
+    Like the live loop, only rate-limited and server-error responses are skipped;
+    everything else (including 404 noAppointmentForThisDay) goes through the parser.
+    """
+    records, skipped = [], 0
+    first_ts = last_ts = None
+    for entry in ResponseRecorder.read(path):
+        first_ts = first_ts or entry["ts"]
+        last_ts = entry["ts"]
+        if entry["status"] == 429 or entry["status"] >= 500:
+            skipped += 1
+            continue
+        records.append((WatchKey(entry["office_id"], entry["service_id"]), entry["body"].encode()))
+        if limit and len(records) >= limit:
+            break
+    return records, skipped, first_ts, last_ts
+
+async def replay(bot, records, repeat: int) -> dict:
+    """Run every record through diff and _apply_change; each pass starts from empty state"""
+    samples = []
+    changed = deltas = errors = 0
+    for _ in range(repeat):
+        bot.availability = AvailabilityTracker()
+        for key, raw in records:
+            started = time.perf_counter()
+            try:
+                change = bot.availability.diff(key, raw, bot._parse_available_days)
+            except Exception:
+                errors += 1
+                continue
+            await bot._apply_change(key, change)
+            samples.append(time.perf_counter() - started)
+            if bot.notifier.pending() >= 1000:
+                # Nothing above yields to the queue worker, so let it catch up
+                await bot.notifier.join()
+            changed += change.changed
+            deltas += change.has_delta
+    # Notification rendering and delivery happen in the queue worker
+    await bot.notifier.join()
+    return {"processed": len(samples), "changed": changed, "deltas": deltas, "errors": errors,
+            "samples": samples}
+
+async def run(args) -> int:
+    records, skipped, first_ts, last_ts = load_records(args.recording, args.limit)
+    if not records:
+        print(f"No replayable responses in {args.recording}")
+        return 1
+    keys = sorted({key for key, _ in records})
+
+    bot = MunichAppointmentBot("123456:replay", state_store=None, watch_targets=keys, warmup=False)
+    telegram = StubTelegram()
+    bot.notifier = NotificationQueue(telegram.send, global_rate=1e9, per_chat_interval=0, linger=0)
+    for key in keys:
+        for chat_id in range(args.subscribers):
+            bot.subscriptions.subscribe(1000 + chat_id, key, 5, args.window_days)
+    bot.tasks.spawn(bot.notifier.run(), name="notifier")
+
+    profiler = cProfile.Profile() if args.profile or args.top else None
+    started = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        result = await replay(bot, records, args.repeat)
+    finally:
+        if profiler:
+            profiler.disable()
+        await bot.tasks.shutdown()
+    elapsed = time.perf_counter() - started
+
+    samples = result.pop("samples")
+    report = {
+        "recording": args.recording,
+        "recorded_from": first_ts,
+        "recorded_to": last_ts,
+        "targets": len(keys),
+        "skipped_429_5xx": skipped,
+        **result,
+        "elapsed_s": round(elapsed, 3),
+        "responses_per_s": round(result["processed"] / elapsed, 1) if elapsed else 0.0,
+        "p50_us": round(percentile(samples, 50) * 1e6, 1) if samples else None,
+        "p95_us": round(percentile(samples, 95) * 1e6, 1) if samples else None,
+        "p99_us": round(percentile(samples, 99) * 1e6, 1) if samples else None,
+        "notifications": telegram.messages,
+        "notification_chars": telegram.chars,
+    }
+    print(f"Replayed {report['processed']} responses for {len(keys)} targets "
+          f"({first_ts} .. {last_ts}) in {elapsed:.2f}s")
+    print(f"  {report['responses_per_s']:.0f} responses/s, per response p50 {report['p50_us']} µs, "
+          f"p95 {report['p95_us']} µs, p99 {report['p99_us']} µs")
+    print(f"  {result['changed']} changed, {result['deltas']} with deltas, {result['errors']} errors, "
+          f"{skipped} 429/5xx skipped")
+    print(f"  {telegram.messages} notifications ({telegram.chars} chars) to {args.subscribers} chats per target")
+
+    if profiler:
+        if args.profile:
+            profiler.dump_stats(args.profile)
+            print(f"Profile written to {args.profile} (view with: python -m pstats {args.profile})")
+        if args.top:
+            pstats.Stats(profiler, stream=sys.stdout).sort_stats(args.sort).print_stats(args.top)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded availability responses offline")
+    parser.add_argument("recording", help="File written via RECORD_RESPONSES_PATH (gzip JSON lines)")
+    parser.add_argument("--subscribers", type=int, default=20, help="Chats subscribed to every recorded target")
+    parser.add_argument("--window-days", type=int, default=180, help="Date window of every subscriber")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the recording this many times")
+    parser.add_argument("--limit", type=int, default=0, help="Only replay the first N responses (0 = all)")
+    parser.add_argument("--profile", help="Write cProfile stats to this file")
+    parser.add_argument("--top", type=int, default=0, help="Print the N most expensive functions")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key for --top (e.g. tottime)")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger("appointment_bot").setLevel(logging.WARNING)
+
+    sys.exit(asyncio.run(run(args)))
+
+if __name__ == "__main__":
+    main()